@@ -0,0 +1,77 @@
+import { describe, it, expect, vi, beforeEach } from 'vitest';
+import { flushPromises, mount } from '@vue/test-utils';
+import axiosInstance from '../../config/api';
+import Comments from '../Comments.vue';
+
+const user = { id: 1, username: 'author', profile: { photo_url: null } };
+
+function comment(id, parent, replies = []) {
+  return {
+    id,
+    post: 1,
+    parent,
+    level: 0,
+    text: `Comment ${id}`,
+    created_at: '2026-10-18T08:51:00Z',
+    user,
+    reply_count: replies.length,
+    replies,
+  };
+}
+
+// The API lists every comment of the thread, each one with its replies nested ↓
+function thread() {
+  const nested = comment(3, 2);
+  const reply = comment(2, 1, [nested]);
+  const root = comment(1, null, [reply]);
+  return JSON.parse(JSON.stringify([root, reply, nested]));
+}
+
+async function mountComments() {
+  vi.spyOn(axiosInstance, 'get').mockResolvedValue({ data: thread() });
+  const wrapper = mount(Comments, { props: { postId: 1, isVisible: true } });
+  await flushPromises();
+  return wrapper;
+}
+
+function renderedTexts(wrapper) {
+  return wrapper.findAll('.comment-content p').map(node => node.text());
+}
+
+beforeEach(() => {
+  vi.restoreAllMocks();
+  // No live updates in the tests ↓
+  vi.stubGlobal('WebSocket', undefined);
+  vi.stubGlobal('EventSource', undefined);
+});
+
+describe('Comments', () => {
+  it('renders a reply pushed under a nested comment', async () => {
+    const wrapper = await mountComments();
+    expect(renderedTexts(wrapper)).toEqual(['Comment 1', 'Comment 2', 'Comment 3']);
+
+    wrapper.vm.applyCommentEvent('created', comment(4, 3));
+    await wrapper.vm.$nextTick();
+
+    expect(renderedTexts(wrapper)).toEqual(['Comment 1', 'Comment 2', 'Comment 3', 'Comment 4']);
+    expect(wrapper.vm.findComment(3).reply_count).toBe(1);
+    expect(wrapper.emitted('update-count').at(-1)).toEqual([4]);
+
+    // The same comment pushed again, or returned by the POST, is not duplicated ↓
+    wrapper.vm.addComment(comment(4, 3));
+    await wrapper.vm.$nextTick();
+    expect(renderedTexts(wrapper)).toHaveLength(4);
+  });
+
+  it('removes a deleted nested comment with its replies', async () => {
+    const wrapper = await mountComments();
+
+    wrapper.vm.applyCommentEvent('deleted', { id: 2, post: 1, parent: 1 });
+    await wrapper.vm.$nextTick();
+
+    expect(renderedTexts(wrapper)).toEqual(['Comment 1']);
+    expect(wrapper.vm.findComment(1).reply_count).toBe(0);
+    expect(wrapper.vm.findComment(3)).toBeNull();
+    expect(wrapper.emitted('update-count').at(-1)).toEqual([1]);
+  });
+});
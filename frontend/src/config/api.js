@@ -21,6 +21,13 @@ axiosInstance.interceptors.request.use(config => {
   return config;
 });
 
+// WebSockets are served by the same host, under /ws instead of /api
+const WS_BASE_URL = API_BASE_URL.replace(/^http/, 'ws').replace(/\/api$/, '/ws');
+
+export const WS_URLS = {
+  POST_COMMENTS: (postId) => `${WS_BASE_URL}/posts/${postId}/comments/`,
+};
+
 export const API_URLS = {
   // Auth endpoints
   LOGIN: `${API_BASE_URL}/login/`,
@@ -33,6 +40,7 @@ export const API_URLS = {
   // Comments endpoints
   COMMENTS: `${API_BASE_URL}/comments/`,
   POST_COMMENTS: (postId) => `${API_BASE_URL}/posts/${postId}/comments/`,
+  POST_COMMENT_EVENTS: (postId) => `${API_BASE_URL}/posts/${postId}/comments/events/`,
   COMMENT_DETAIL: (id) => `${API_BASE_URL}/comments/${id}/`,
 };
 
@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import Post, Comment, Profile
+from .models import Post, Comment, Profile, ImageJob
 
 
 # Register the objects we need in the admin panel
 admin.site.register(Comment)
 admin.site.register(Post)
 admin.site.register(Profile)
+admin.site.register(ImageJob)
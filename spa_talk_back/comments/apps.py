@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CommentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'comments'
+
+    def ready(self):
+        # Cache invalidation, real-time push, tombstone, replica routing
+        # and connection counting receivers ↓
+        from . import cache, pooling, realtime, routers, sync  # noqa: F401
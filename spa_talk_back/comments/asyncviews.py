@@ -0,0 +1,51 @@
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+
+class AsyncViewMixin:
+    """
+    Serves a DRF view or viewset as an async Django view. Handlers written
+    with async def run on the event loop and use the async ORM; the other
+    handlers, and authentication, permissions and throttling, run in a
+    worker thread like any sync view would under ASGI. Under WSGI Django
+    runs the view in its own event loop, so nothing changes for runserver
+    or the tests.
+    """
+    view_is_async = True
+
+    @classmethod
+    def as_view(cls, *args, **initkwargs):
+        view = super().as_view(*args, **initkwargs)
+        if iscoroutinefunction(view):
+            return view
+
+        # ViewSetMixin.as_view builds a plain function around dispatch ↓
+        @wraps(view)
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+        return async_view
+
+    async def dispatch(self, request, *args, **kwargs):
+        # APIView.dispatch, awaiting the handler ↓
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
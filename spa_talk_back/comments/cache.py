@@ -0,0 +1,198 @@
+import threading
+from collections import OrderedDict
+from hashlib import md5
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.checks import Tags, Warning, register
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Comment, Post, Profile
+
+MISSING = object()
+
+
+class TwoTierCache:
+    """
+    A small per-process LRU in front of a shared Django cache backend.
+
+    Hot keys are answered from process memory without a round trip to the
+    shared backend. Local entries only live for `local_ttl` seconds, which
+    bounds how long another process can serve a value this process has
+    already invalidated; the shared entry is deleted right away. That bound
+    only holds if the backend really is shared: on a local-memory backend
+    other processes never see the deletes (see check_shared_cache).
+    """
+
+    def __init__(self, alias='default', max_entries=1024, local_ttl=5, timeout=300):
+        self.alias = alias
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.timeout = timeout
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.local[key] = (monotonic() + self.local_ttl, value)
+            self.local.move_to_end(key)
+            while len(self.local) > self.max_entries:
+                self.local.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None:
+                if entry[0] > monotonic():
+                    self.local.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.local[key]
+
+        value = self.shared.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            return MISSING
+        self.shared_hits += 1
+        self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        self.shared.set(key, value, self.timeout)
+        self._remember(key, value)
+
+    def get_or_set(self, key, compute):
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def delete(self, key):
+        with self.lock:
+            self.local.pop(key, None)
+        self.shared.delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.local.clear()
+        self.shared.clear()
+
+
+api_cache = TwoTierCache(
+    alias=settings.API_CACHE_ALIAS,
+    max_entries=settings.API_CACHE_LOCAL_SIZE,
+    local_ttl=settings.API_CACHE_LOCAL_TTL,
+    timeout=settings.API_CACHE_TIMEOUT,
+)
+
+
+# Author fragments (UserSerializer output) contain absolute photo URLs, so
+# one entry per user holds a fragment for each scheme and host it was built for,
+# and for each shape (e.g. 'compact', see comments.fieldsets) ↓
+def cached_author(user_id, request, compute, variant=''):
+    key = f"author:{user_id}"
+    origin = f"{request.scheme}://{request.get_host()}" if request else ''
+    origin = f"{origin}|{variant}" if variant else origin
+    fragments = api_cache.get(key)
+    if fragments is MISSING:
+        fragments = {}
+    if origin not in fragments:
+        fragments = {**fragments, origin: compute()}
+        api_cache.set(key, fragments)
+    return fragments[origin]
+
+
+# Anonymous post-list pages are keyed by a generation number kept in the
+# shared cache. Any change that can show up on a page bumps it, which
+# invalidates every cached page in every process at once ↓
+POST_LIST_GENERATION_KEY = 'posts:generation'
+# Bumped when any author changes (username, photo...), for the validators
+# of responses that embed authors but have no column that would tell ↓
+AUTHORS_GENERATION_KEY = 'authors:generation'
+
+
+def generation(key):
+    return api_cache.shared.get_or_set(key, 0, None)
+
+
+def bump_generation(key):
+    try:
+        api_cache.shared.incr(key)
+    except ValueError:
+        api_cache.shared.set(key, 1, None)
+
+
+def post_list_generation():
+    return generation(POST_LIST_GENERATION_KEY)
+
+
+def bump_post_list_generation():
+    bump_generation(POST_LIST_GENERATION_KEY)
+
+
+def authors_generation():
+    return generation(AUTHORS_GENERATION_KEY)
+
+
+def post_list_cache_key(request):
+    # The media type can ask for another shape (e.g. users=normalized) ↓
+    query = md5(f"{request.get_full_path()}|{request.accepted_media_type}".encode()).hexdigest()
+    origin = f"{request.scheme}://{request.get_host()}"
+    return f"posts:list:{post_list_generation()}:{origin}:{query}"
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    invalidate_author(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile(sender, instance, **kwargs):
+    invalidate_author(instance.user_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_post_list(sender, instance, **kwargs):
+    bump_post_list_generation()
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Invalidation deletes shared entries and bumps generations in the shared
+    backend, a local-memory one leaves every other server process stale.
+    Settings already refuse it for WEB_CONCURRENCY > 1, this also catches
+    several single-worker instances (manage.py check --deploy)
+    """
+    backend = settings.CACHES[settings.API_CACHE_ALIAS]['BACKEND']
+    if backend != 'django.core.cache.backends.locmem.LocMemCache':
+        return []
+    return [Warning(
+        "The API cache is a local-memory cache, cached responses won't be "
+        "invalidated across server processes.",
+        hint="Set CACHE_URL to a shared cache (e.g. redis://) whenever more than one "
+             "server process runs.",
+        id='comments.W001',
+    )]
+
+
+def invalidate_author(user_id):
+    api_cache.delete(f"author:{user_id}")
+    bump_generation(AUTHORS_GENERATION_KEY)
+    bump_post_list_generation()
@@ -0,0 +1,218 @@
+import os
+import random
+import secrets
+import threading
+from collections import deque
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from PIL import Image, ImageDraw, ImageFont
+
+from .utils import generate_captcha_text
+
+WIDTH = 280
+HEIGHT = 80
+FONT_SIZE = 36
+FONT_PATHS = ('arial.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf')
+LIGHT_NOISE = (204, 204, 204)
+DARK_NOISE = (102, 102, 102)
+
+# Noise masks are made from one buffer of random bytes: values below the
+# first level become light dots, the next ones dark dots (~1000 in all) ↓
+LIGHT_TABLE = [255 if value < 6 else 0 for value in range(256)]
+DARK_TABLE = [255 if 6 <= value < 12 else 0 for value in range(256)]
+
+
+@lru_cache(maxsize=None)
+def load_font(size=FONT_SIZE):
+    """The font is resolved once per process instead of on every captcha"""
+    for path in FONT_PATHS:
+        try:
+            return ImageFont.truetype(path, size=size)
+        except OSError:
+            continue
+    # if no system font is found, use the default font
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=None)
+def char_width(char):
+    return load_font().getlength(char)
+
+
+def render_captcha(text):
+    """PNG bytes of a captcha image with the given text"""
+    image = Image.new('RGB', (WIDTH, HEIGHT), 'white')
+
+    # Add random noise, the whole buffer at once ↓
+    noise = Image.frombytes('L', (WIDTH, HEIGHT), os.urandom(WIDTH * HEIGHT))
+    image.paste(LIGHT_NOISE, (0, 0, WIDTH, HEIGHT), noise.point(LIGHT_TABLE))
+    image.paste(DARK_NOISE, (0, 0, WIDTH, HEIGHT), noise.point(DARK_TABLE))
+
+    draw = ImageDraw.Draw(image)
+    font = load_font()
+    x = (WIDTH - sum(char_width(char) for char in text)) / 2
+    y = (HEIGHT - FONT_SIZE) / 2
+
+    # Draw each character with a random color and a slight offset
+    for char in text:
+        color = (random.randint(0, 100), random.randint(0, 100), random.randint(0, 100))
+        draw.text((x + random.randint(-5, 5), y + random.randint(-5, 5)), char, font=font, fill=color)
+        x += char_width(char)
+
+    # Add random lines
+    for _ in range(4):
+        start = (random.randint(0, WIDTH), random.randint(0, HEIGHT))
+        end = (random.randint(0, WIDTH), random.randint(0, HEIGHT))
+        draw.line([start, end], fill=DARK_NOISE, width=2)
+
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def new_challenge():
+    text = generate_captcha_text()
+    return text, render_captcha(text)
+
+
+class CaptchaPool:
+    """
+    Pre-rendered (text, png) challenges.
+
+    A daemon thread tops the pool up whenever it drops below half, so a
+    request only renders a captcha itself when the pool has run dry. The
+    thread is started lazily, once per process (also after a fork).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.challenges = deque()
+        self.wanted = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def take(self):
+        self.start()
+        try:
+            challenge = self.challenges.popleft()
+            self.hits += 1
+        except IndexError:
+            challenge = new_challenge()
+            self.misses += 1
+        if len(self.challenges) < self.size // 2:
+            self.wanted.set()
+        return challenge
+
+    def start(self):
+        if not self.size or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.challenges.clear()
+            self.wanted.set()
+            self.thread = threading.Thread(target=self.refill, name='captcha-pool', daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def refill(self):
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            self.fill()
+
+    def fill(self):
+        while len(self.challenges) < self.size:
+            self.challenges.append(new_challenge())
+
+
+captcha_pool = CaptchaPool(settings.CAPTCHA_POOL_SIZE)
+
+
+# The image is served by CaptchaImageView from the shared cache under an
+# unguessable key (settings refuse a local-memory cache for several workers,
+# the worker serving the image is rarely the one that issued it). In stateless mode (CAPTCHA_STATELESS) the answer travels
+# with the client in a signed token instead of the session, so showing a
+# captcha writes no session row ↓
+TOKEN_SALT = 'comments.captcha'
+
+
+def captcha_image_key(key):
+    return f"captcha:image:{key}"
+
+
+def captcha_used_key(key):
+    return f"captcha:used:{key}"
+
+
+def answer_digest(key, answer):
+    return salted_hmac(TOKEN_SALT, f"{key}:{answer.strip().upper()}").hexdigest()
+
+
+def issue_captcha(request, purpose):
+    """
+    Stores a new challenge for `purpose` and returns the response fields:
+    the URL of its image and, in stateless mode, the token to send back
+    """
+    text, image = captcha_pool.take()
+    key = secrets.token_urlsafe(16)
+    caches[settings.API_CACHE_ALIAS].set(captcha_image_key(key), image, settings.CAPTCHA_TIMEOUT)
+    data = {'captcha_image': request.build_absolute_uri(reverse('captcha-image', args=[key]))}
+
+    if settings.CAPTCHA_STATELESS:
+        # Only an HMAC of the answer goes into the token ↓
+        data['captcha_token'] = signing.dumps(
+            {'k': key, 'p': purpose, 'a': answer_digest(key, text)}, salt=TOKEN_SALT, compress=True)
+    else:
+        request.session[f'{purpose}_captcha_text'] = text
+        request.session.save()  # Force saving the session
+    return data
+
+
+def captcha_image(key):
+    return caches[settings.API_CACHE_ALIAS].get(captcha_image_key(key))
+
+
+def check_captcha(request, purpose):
+    """
+    None when the captcha answer of the request is right, otherwise the error
+    message. Either way the challenge is used up, a token can't be replayed
+    """
+    answer = str(request.data.get('captcha', '')).strip().upper()
+    token = request.data.get('captcha_token')
+    if token:
+        return check_token(token, purpose, answer)
+
+    stored = request.session.pop(f'{purpose}_captcha_text', '').strip().upper()
+    if not answer or not stored:
+        return "Captcha is required"
+    if answer != stored:
+        return "Invalid captcha"
+    return None
+
+
+def check_token(token, purpose, answer):
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=settings.CAPTCHA_TIMEOUT)
+    except signing.BadSignature:  # also raised for expired tokens
+        return "Captcha expired"
+    if payload.get('p') != purpose or not answer:
+        return "Captcha is required"
+
+    # Spent tokens are remembered until they would have expired anyway ↓
+    cache = caches[settings.API_CACHE_ALIAS]
+    if not cache.add(captcha_used_key(payload['k']), 1, settings.CAPTCHA_TIMEOUT):
+        return "Captcha expired"
+    cache.delete(captcha_image_key(payload['k']))
+    if not constant_time_compare(answer_digest(payload['k'], answer), payload['a']):
+        return "Invalid captcha"
+    return None
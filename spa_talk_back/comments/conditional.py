@@ -0,0 +1,71 @@
+from hashlib import md5
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """Strong ETag from the given parts"""
+    return '"%s"' % md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def queryset_validators(queryset, request, extra=(), **aggregates):
+    """
+    ETag and Last-Modified of a listing in a single aggregate query:
+    the updated_at high-water mark and the row count (which also changes on
+    deletes), plus any extra aggregates and parts, the requested URL (page,
+    filters) and the negotiated media type, so each representation has its own tag
+    """
+    stats = queryset.order_by().aggregate(
+        last_modified=Max('updated_at'), count=Count('pk'), **aggregates)
+    return stats_validators(stats, request, extra)
+
+
+async def aqueryset_validators(queryset, request, extra=(), **aggregates):
+    """queryset_validators for async views"""
+    stats = await queryset.order_by().aaggregate(
+        last_modified=Max('updated_at'), count=Count('pk'), **aggregates)
+    return stats_validators(stats, request, extra)
+
+
+def stats_validators(stats, request, extra=()):
+    parts = [stats[key] for key in sorted(stats)]
+    etag = make_etag(request.get_full_path(), request.accepted_media_type, *extra, *parts)
+    return etag, stats['last_modified']
+
+
+def page_validators(objects, request, *fields, extra=()):
+    """
+    ETag and Last-Modified of a page of rows that was fetched anyway: the
+    id, updated_at and given fields of each row, so nothing outside the
+    page is scanned. Rows moving in or out of the page change the ids.
+    """
+    parts = [(obj.pk, obj.updated_at, *(getattr(obj, field) for field in fields))
+             for obj in objects]
+    last_modified = max((obj.updated_at for obj in objects), default=None)
+    etag = make_etag(request.get_full_path(), request.accepted_media_type, *extra, *parts)
+    return etag, last_modified
+
+
+def instance_validators(instance, request, *fields, extra=()):
+    parts = [getattr(instance, field) for field in fields]
+    etag = make_etag(request.get_full_path(), request.accepted_media_type,
+                     instance.updated_at, *extra, *parts)
+    return etag, instance.updated_at
+
+
+def not_modified(request, etag, last_modified):
+    """
+    304 Not Modified (or 412 for unsafe methods) when the client's copy is
+    still current per If-None-Match / If-Modified-Since, otherwise None
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def set_validators(response, etag, last_modified):
+    response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
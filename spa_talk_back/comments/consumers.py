@@ -0,0 +1,28 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .models import Post
+from .realtime import post_comments_group
+
+
+class PostCommentsConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes the comments created or deleted under a post as
+    {"event": "created" | "deleted", "comment": {...}} messages.
+    The socket is read-only, comments are still posted through the API.
+    """
+
+    async def connect(self):
+        self.post_id = self.scope['url_route']['kwargs']['post_id']
+        if not await Post.objects.filter(pk=self.post_id).aexists():
+            await self.close()
+            return
+        self.group = post_comments_group(self.post_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group'):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def comment_event(self, message):
+        await self.send_json({'event': message['event'], 'comment': message['delta']})
@@ -0,0 +1,189 @@
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_header_parameters
+from rest_framework.serializers import DateTimeField, ListSerializer
+
+# Columns behind an author, in full (UserSerializer) and compact form ↓
+AUTHOR_COLUMNS = [
+    'id', 'username', 'email',
+    'profile__id', 'profile__photo', 'profile__photo_status', 'profile__photo_meta',
+    'profile__home_page',
+]
+COMPACT_AUTHOR_COLUMNS = ['id', 'username', 'profile__id', 'profile__photo']
+
+
+def split_param(value):
+    return {name.strip() for name in value.split(',') if name.strip()} if value else set()
+
+
+class Fieldset:
+    """
+    The fields a client asked for with ?fields=a,b and/or ?omit=c,d,
+    whether authors should be compact (?author=compact: id, username and
+    photo_url only) and whether they are side-loaded once per response
+    (?users=normalized, or a users=normalized parameter of the Accept
+    media type). Only read requests are trimmed, writes always see every
+    field. Renderers with native_datetimes (e.g. MessagePack) get datetime
+    objects instead of ISO strings.
+    """
+
+    def __init__(self, fields=None, omit=(), compact_author=False, normalized_users=False,
+                 native_datetimes=False):
+        self.fields = set(fields) if fields else None
+        self.omit = set(omit)
+        self.compact_author = compact_author
+        self.normalized_users = normalized_users
+        self.native_datetimes = native_datetimes
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None:
+            return cls()
+        renderer = getattr(request, 'accepted_renderer', None)
+        native_datetimes = getattr(renderer, 'native_datetimes', False)
+        if request.method not in ('GET', 'HEAD'):
+            return cls(native_datetimes=native_datetimes)
+        params = request.query_params
+        media_params = parse_header_parameters(getattr(request, 'accepted_media_type', None) or '')[1]
+        return cls(
+            fields=split_param(params.get('fields')),
+            omit=split_param(params.get('omit')),
+            compact_author=params.get('author') == 'compact',
+            normalized_users='normalized' in (params.get('users'), media_params.get('users')),
+            native_datetimes=native_datetimes,
+        )
+
+    @property
+    def trims(self):
+        return self.fields is not None or bool(self.omit)
+
+    def allows(self, name):
+        return (self.fields is None or name in self.fields) and name not in self.omit
+
+    def nested(self):
+        """The fieldset of resources embedded in another one: only the author modes carry over"""
+        return Fieldset(
+            compact_author=self.compact_author, normalized_users=self.normalized_users,
+            native_datetimes=self.native_datetimes)
+
+    def author_columns(self, prefix):
+        columns = COMPACT_AUTHOR_COLUMNS if self.compact_author else AUTHOR_COLUMNS
+        return [f'{prefix}__{column}' for column in columns]
+
+    def trim(self, queryset, serializer_class):
+        """
+        Loads only the columns and joins the serializer needs for the
+        requested fields. Meta.sparse_always lists columns that are always
+        needed (ordering, tree building), Meta.sparse_sources maps method
+        and nested fields to their columns; a callable gets the fieldset.
+        """
+        meta = serializer_class.Meta
+        sources = getattr(meta, 'sparse_sources', {})
+        columns = set(getattr(meta, 'sparse_always', ('id',)))
+        model_fields = {field.name for field in meta.model._meta.concrete_fields}
+        for name in meta.fields:
+            if not self.allows(name):
+                continue
+            if name in sources:
+                source = sources[name]
+                columns.update(source(self) if callable(source) else source)
+            elif name in model_fields:
+                columns.add(name)
+
+        relations = {column.rsplit('__', 1)[0] for column in columns if '__' in column}
+        if relations:
+            queryset = queryset.select_related(*sorted(relations))
+        return queryset.only(*sorted(columns))
+
+
+class SparseFieldsMixin:
+    """
+    Drops the fields the context's fieldset excludes. Only the resource
+    itself is trimmed (the root serializer, or the child of a root list),
+    nested serializers such as the author keep their shape.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.context.get('fieldset')
+        if fieldset is not None and fieldset.native_datetimes:
+            for field in fields.values():
+                if isinstance(field, DateTimeField):
+                    field.format = None
+        if fieldset is None or not fieldset.trims or not self.is_resource():
+            return fields
+        return {name: field for name, field in fields.items() if fieldset.allows(name)}
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Side-loaded authors are referenced by id only (see UserMap) ↓
+        if 'users' in self.context and 'user' in data:
+            data = {('user_id' if name == 'user' else name): value for name, value in data.items()}
+        return data
+
+    def is_resource(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, ListSerializer) and parent.parent is None)
+
+
+class UserMap:
+    """
+    Authors of a normalized response: each one is rendered once into the
+    top-level "users" map, posts and comments only carry its user_id
+    """
+
+    def __init__(self):
+        self.users = {}
+
+    def add(self, user_id, render):
+        if user_id not in self.users:
+            self.users[user_id] = render()
+        return user_id
+
+    @property
+    def data(self):
+        # String keys, as JSON has them anyway and MessagePack clients expect ↓
+        return {str(user_id): user for user_id, user in self.users.items()}
+
+
+def attach_users(data, context):
+    """Adds the side-loaded authors to a response, a plain list becomes {"results": [...]}"""
+    users = context.get('users')
+    if users is None:
+        return data
+    if isinstance(data, list):
+        data = {'results': data}
+    return {**data, 'users': users.data}
+
+
+class FieldsetMixin:
+    """
+    Passes the fieldset of the request (?fields=, ?omit=, ?author=) to the
+    view's serializers; get_queryset trims with self.fieldset.trim.
+    Views setting normalizes_users side-load the authors of their
+    responses with attach_users when the client asks for it.
+    """
+    normalizes_users = False
+
+    @property
+    def fieldset(self):
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = Fieldset.from_request(self.request)
+        return self._fieldset
+
+    def get_fieldset_context(self):
+        context = {'fieldset': self.fieldset}
+        if self.normalizes_users and self.fieldset.normalized_users:
+            # One map for the whole response, however many serializers fill it ↓
+            if not hasattr(self, '_users'):
+                self._users = UserMap()
+            context['users'] = self._users
+        return context
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), **self.get_fieldset_context()}
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.normalizes_users:
+            patch_vary_headers(response, ('Accept',))
+        return response
@@ -0,0 +1,335 @@
+import math
+import os
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image
+
+from .cache import bump_post_list_generation, invalidate_author
+from .models import ImageJob, Profile
+
+try:
+    # Registers AVIF on Pillow builds without native support
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Post and comment images are fitted into this box, profile photos are kept as is
+FIT_INTO = {
+    'image': (320, 240),
+}
+# Widths of the responsive variants and the formats they are encoded in,
+# formats this Pillow build cannot write are skipped ↓
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+VARIANT_FORMATS = {
+    'AVIF': ('avif', 'image/avif', {'quality': 60}),
+    'WEBP': ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+}
+# BlurHash components of the placeholder, and the size it is computed from
+PLACEHOLDER_COMPONENTS = (4, 3)
+PLACEHOLDER_SAMPLE = 32
+# A job left in processing this long belongs to a worker that died
+STALE_JOB_TIMEOUT = timedelta(minutes=10)
+MAX_ATTEMPTS = 3
+
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def variant_formats():
+    Image.init()
+    return [image_format for image_format in VARIANT_FORMATS if image_format in Image.SAVE]
+
+
+def encode83(value, length):
+    return ''.join(
+        BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def srgb_to_linear(value):
+    value = value / 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def linear_to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(img, components=PLACEHOLDER_COMPONENTS):
+    """
+    BlurHash (https://blurha.sh) of the image: a ~20 character string
+    clients decode into a blurred placeholder while the image loads
+    """
+    x_components, y_components = components
+    sample = img.convert('RGB')
+    sample.thumbnail((PLACEHOLDER_SAMPLE, PLACEHOLDER_SAMPLE))
+    width, height = sample.size
+    pixels = [tuple(srgb_to_linear(channel) for channel in pixel) for pixel in sample.getdata()]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            total = [0.0, 0.0, 0.0]
+            for y in range(height):
+                basis_y = math.cos(math.pi * j * y / height)
+                row = pixels[y * width:(y + 1) * width]
+                for x, pixel in enumerate(row):
+                    basis = basis_y * math.cos(math.pi * i * x / width)
+                    for channel in range(3):
+                        total[channel] += basis * pixel[channel]
+            scale = normalisation / (width * height)
+            factors.append([channel * scale for channel in total])
+
+    dc, ac = factors[0], factors[1:]
+    result = encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(channel) for factor in ac for channel in factor)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+        result += encode83(quantised_max, 1)
+    else:
+        maximum = 1
+        result += encode83(0, 1)
+
+    result += encode83((linear_to_srgb(dc[0]) << 16) + (linear_to_srgb(dc[1]) << 8)
+                       + linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        quantised = [
+            max(0, min(18, int(math.copysign(abs(channel / maximum) ** 0.5, channel) * 9 + 9.5)))
+            for channel in factor
+        ]
+        result += encode83(quantised[0] * 19 * 19 + quantised[1] * 19 + quantised[2], 2)
+    return result
+
+
+def encode_variants(img):
+    """Responsive variants of the image, never wider than the original"""
+    widths = [width for width in VARIANT_WIDTHS if width < img.width] + [img.width]
+    widths = sorted(set(min(width, VARIANT_WIDTHS[-1]) for width in widths))
+    variants = []
+    for width in widths:
+        height = max(1, round(img.height * width / img.width))
+        resized = img.resize((width, height), Image.Resampling.LANCZOS)
+        if resized.mode not in ('RGB', 'RGBA'):
+            resized = resized.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        for image_format in variant_formats():
+            extension, mime_type, options = VARIANT_FORMATS[image_format]
+            output = BytesIO()
+            resized.save(output, format=image_format, **options)
+            variants.append({
+                'width': width,
+                'height': height,
+                'extension': extension,
+                'type': mime_type,
+                'data': output.getvalue(),
+            })
+    return variants
+
+
+def process_image(data, fit_into=None):
+    """
+    Fits the image into `fit_into` keeping its format (`resized` is None when
+    it already fits or no box is given) and encodes its responsive variants
+    and placeholder. Runs in the worker processes, so it only deals with
+    bytes, never the database.
+    """
+    with Image.open(BytesIO(data)) as img:
+        image_format = img.format
+        width, height = img.size
+        # JPEGs are decoded straight at the largest size anything below needs
+        # (libjpeg scales by 1/2 to 1/8 while decoding), so a big photo never
+        # sits in memory at full resolution ↓
+        if image_format == 'JPEG':
+            largest = min(width, VARIANT_WIDTHS[-1])
+            img.draft('RGB', (largest, max(1, round(height * largest / width))))
+        img.load()
+        result = {
+            'resized': None,
+            'width': width,
+            'height': height,
+            'placeholder': blurhash(img),
+            'variants': encode_variants(img),
+        }
+        if fit_into and (width > fit_into[0] or height > fit_into[1]):
+            img.thumbnail(fit_into)
+            output = BytesIO()
+            if image_format == 'JPEG':
+                img.save(output, format='JPEG', quality=85)
+            else:
+                img.save(output, format=image_format)
+            result.update(resized=output.getvalue(), width=img.width, height=img.height)
+        return result
+
+
+def resized_name(source):
+    root, ext = os.path.splitext(source)
+    return f"{root}_resized{ext}"
+
+
+def fail_exhausted_jobs():
+    """
+    Fails the stale jobs whose worker died on the last attempt, so their
+    object stops reporting the image as pending. Each job is failed with a
+    conditional UPDATE, only the worker that wins it touches the object.
+    """
+    stale = timezone.now() - STALE_JOB_TIMEOUT
+    exhausted = Q(status=ImageJob.PROCESSING, updated_at__lt=stale, attempts__gte=MAX_ATTEMPTS)
+    for job in ImageJob.objects.filter(exhausted).select_related('content_type'):
+        error = f"Gave up after {job.attempts} attempts"
+        updated = ImageJob.objects.filter(exhausted, pk=job.pk).update(
+            status=ImageJob.FAILED,
+            error=error,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            print(f"Error processing image {job.source}: {error}")
+            update_target(job, **{f'{job.field_name}_status': ImageJob.FAILED})
+
+
+def claim_jobs(limit):
+    """
+    Marks up to `limit` pending (or stale) jobs as processing and returns
+    them. Each job is claimed with a conditional UPDATE, so several workers
+    can poll the same table without locks or a broker.
+    """
+    fail_exhausted_jobs()
+    stale = timezone.now() - STALE_JOB_TIMEOUT
+    available = (
+        Q(status=ImageJob.PENDING)
+        | Q(status=ImageJob.PROCESSING, updated_at__lt=stale, attempts__lt=MAX_ATTEMPTS)
+    )
+    candidates = ImageJob.objects.filter(available).values_list('pk', flat=True)[:limit]
+
+    claimed = []
+    for pk in candidates:
+        updated = ImageJob.objects.filter(available, pk=pk).update(
+            status=ImageJob.PROCESSING,
+            attempts=F('attempts') + 1,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            claimed.append(pk)
+    return list(ImageJob.objects.filter(pk__in=claimed).select_related('content_type'))
+
+
+def variant_name(source, width, extension):
+    root, _ = os.path.splitext(source)
+    return f"{root}_{width}w.{extension}"
+
+
+def update_target(job, **fields):
+    # Only touch the object if it still points at this upload ↓
+    model = job.content_type.model_class()
+    if any(field.name == 'updated_at' for field in model._meta.fields):
+        fields['updated_at'] = timezone.now()
+    targets = model.objects.filter(pk=job.object_id, **{job.field_name: job.source})
+    targets.update(**fields)
+
+    # Profiles are part of the cached author fragments ↓
+    if model is Profile:
+        user_id = model.objects.filter(pk=job.object_id).values_list('user_id', flat=True).first()
+        if user_id:
+            invalidate_author(user_id)
+    else:
+        bump_post_list_generation()
+
+
+def finish_job(job, processed):
+    """Stores the resized image and variants and points the object at them"""
+    storage = job.content_type.model_class()._meta.get_field(job.field_name).storage
+    if processed['resized'] is None:
+        result = job.source
+    else:
+        result = storage.save(resized_name(job.source), ContentFile(processed['resized']))
+
+    meta = {
+        'width': processed['width'],
+        'height': processed['height'],
+        'placeholder': processed['placeholder'],
+        'variants': [
+            {
+                'name': storage.save(
+                    variant_name(job.source, variant['width'], variant['extension']),
+                    ContentFile(variant['data'])),
+                'width': variant['width'],
+                'height': variant['height'],
+                'type': variant['type'],
+            }
+            for variant in processed['variants']
+        ],
+    }
+
+    update_target(job, **{
+        job.field_name: result,
+        f'{job.field_name}_status': ImageJob.DONE,
+        f'{job.field_name}_meta': meta,
+    })
+    job.status = ImageJob.DONE
+    job.result = result
+    job.meta = meta
+    job.error = ''
+    job.save(update_fields=['status', 'result', 'meta', 'error', 'updated_at'])
+
+
+def fail_job(job, error):
+    print(f"Error processing image {job.source}: {error}")
+    update_target(job, **{f'{job.field_name}_status': ImageJob.FAILED})
+    job.status = ImageJob.FAILED
+    job.error = str(error)
+    job.save(update_fields=['status', 'error', 'updated_at'])
+
+
+def reuse_processed(job):
+    """Finishes the job right away if an equal upload was already processed"""
+    done = (
+        ImageJob.objects.filter(checksum=job.checksum, field_name=job.field_name, status=ImageJob.DONE)
+        .exclude(result='')
+        .first()
+    )
+    if done is None:
+        return False
+    update_target(job, **{
+        job.field_name: done.result,
+        f'{job.field_name}_status': ImageJob.DONE,
+        f'{job.field_name}_meta': done.meta,
+    })
+    job.status = ImageJob.DONE
+    job.result = done.result
+    job.meta = done.meta
+    job.save(update_fields=['status', 'result', 'meta', 'updated_at'])
+    return True
+
+
+def read_source(job):
+    storage = job.content_type.model_class()._meta.get_field(job.field_name).storage
+    with storage.open(job.source, 'rb') as source:
+        return source.read()
+
+
+def process_jobs(jobs, executor):
+    """
+    Runs the image work of the claimed jobs in the executor (a process pool)
+    while this process keeps all database and storage work
+    """
+    futures = {}
+    for job in jobs:
+        if reuse_processed(job):
+            continue
+        try:
+            fit_into = FIT_INTO.get(job.field_name)
+            futures[executor.submit(process_image, read_source(job), fit_into)] = job
+        except Exception as e:
+            fail_job(job, e)
+
+    for future, job in futures.items():
+        try:
+            finish_job(job, future.result())
+        except Exception as e:
+            fail_job(job, e)
+    return len(jobs)
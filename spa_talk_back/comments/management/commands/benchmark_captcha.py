@@ -0,0 +1,35 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from comments.captcha import CaptchaPool, new_challenge
+
+
+class Command(BaseCommand):
+    help = "Measures how many captchas per second are rendered and served from the pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=500,
+            help="Number of captchas per measurement")
+
+    def handle(self, *args, **options):
+        count = options['count']
+
+        started = time.perf_counter()
+        size = sum(len(new_challenge()[1]) for _ in range(count))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"render: {count / elapsed:.0f} captchas/sec, {size / count / 1024:.1f}KB per image")
+
+        # A full pool is what requests see between bursts ↓
+        pool = CaptchaPool(count)
+        pool.fill()
+        pool.pid = os.getpid()  # keep the refill thread out of the measurement
+        started = time.perf_counter()
+        for _ in range(count):
+            pool.take()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"pool: {count / elapsed:.0f} captchas/sec ({pool.hits} hits, {pool.misses} misses)")
@@ -0,0 +1,75 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from comments.middleware import brotli
+from comments.renderers import ORJSONRenderer
+from comments.tree import CommentTree, load_post_comments
+
+
+def synthetic_thread(count):
+    """A flat thread payload shaped like CommentTree output, without the database"""
+    now = timezone.now().isoformat()
+    author = {
+        'id': 1, 'username': 'author', 'email': 'author@example.com',
+        'profile': {'photo': None, 'photo_url': 'http://localhost/media/user_photos/default.jpg',
+                    'photo_status': '', 'photo_variants': None, 'home_page': None},
+    }
+    return [{
+        'id': i, 'post': 1, 'user': author, 'text': f"Comment number {i} <i>with</i> some text",
+        'created_at': now, 'updated_at': now, 'image': None, 'image_status': '',
+        'image_variants': None, 'file': None, 'parent': i - 1 if i % 4 else None,
+        'reply_count': 1, 'replies': [], 'level': i % 4,
+        'parent_text': None, 'parent_info': None,
+    } for i in range(count)]
+
+
+class Command(BaseCommand):
+    help = "Compares the JSON renderers and compression levels on a comment thread"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--post', type=int,
+            help="Render the thread of this post instead of a synthetic one")
+        parser.add_argument(
+            '--comments', type=int, default=2000,
+            help="Number of comments of the synthetic thread")
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help="Renders per measurement")
+
+    def handle(self, *args, **options):
+        if options['post']:
+            request = Request(APIRequestFactory().get('/'))
+            data = CommentTree(
+                load_post_comments(options['post']), context={'request': request}).data
+        else:
+            data = synthetic_thread(options['comments'])
+        repeat = options['repeat']
+
+        for renderer in (JSONRenderer(), ORJSONRenderer()):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                content = renderer.render(data, 'application/json')
+            elapsed = (time.perf_counter() - started) / repeat
+            self.stdout.write(
+                f"{type(renderer).__name__}: {elapsed * 1000:.1f}ms, {len(content) / 1024:.0f}KB")
+
+        codings = [('gzip', level) for level in (1, 5, 9)]
+        if brotli is not None:
+            codings += [('br', quality) for quality in (1, 4, 11)]
+        for coding, level in codings:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                if coding == 'br':
+                    compressed = brotli.compress(content, quality=level)
+                else:
+                    compressed = gzip.compress(content, compresslevel=level, mtime=0)
+            elapsed = (time.perf_counter() - started) / repeat
+            self.stdout.write(
+                f"{coding} {level}: {elapsed * 1000:.1f}ms, {len(compressed) / 1024:.0f}KB")
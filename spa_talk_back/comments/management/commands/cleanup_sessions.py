@@ -0,0 +1,60 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+# Keys the captcha views used to write for anonymous visitors
+CAPTCHA_SESSION_KEYS = {'login_captcha_text', 'register_captcha_text'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired rows of the database session table in small batches, "
+        "unlike clearsessions which removes them in one statement"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="How many sessions are deleted per statement")
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help="Seconds to sleep between batches")
+        parser.add_argument(
+            '--captcha-only', action='store_true',
+            help="Also delete live sessions that are empty or hold only a captcha answer")
+
+    def handle(self, *args, **options):
+        expired = Session.objects.filter(expire_date__lt=timezone.now())
+        deleted = self.delete_in_batches(expired, options)
+        self.stdout.write(f"Deleted {deleted} expired session(s)")
+
+        if options['captcha_only']:
+            deleted = self.delete_in_batches(Session.objects.all(), options, self.captcha_only)
+            self.stdout.write(f"Deleted {deleted} empty or captcha-only session(s)")
+
+        self.stdout.write(self.style.SUCCESS("Done"))
+
+    def delete_in_batches(self, queryset, options, predicate=None):
+        # Walk the table by primary key so each batch is a short index range ↓
+        deleted = 0
+        last_key = ''
+        while True:
+            batch = list(
+                queryset.filter(session_key__gt=last_key)
+                .order_by('session_key')
+                .values_list('session_key', 'session_data')[:options['batch_size']]
+            )
+            if not batch:
+                return deleted
+            last_key = batch[-1][0]
+            keys = [key for key, data in batch if predicate is None or predicate(data)]
+            if keys:
+                deleted += Session.objects.filter(session_key__in=keys).delete()[0]
+            if options['pause']:
+                time.sleep(options['pause'])
+
+    def captcha_only(self, session_data):
+        data = Session(session_data=session_data).get_decoded()
+        return set(data) <= CAPTCHA_SESSION_KEYS
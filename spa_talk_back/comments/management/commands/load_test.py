@@ -0,0 +1,60 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+
+def fetch(url, headers):
+    started = time.perf_counter()
+    try:
+        with urlopen(Request(url, headers=headers), timeout=60) as response:
+            response.read()
+            ok = response.status == 200
+    except (URLError, OSError):
+        ok = False
+    return ok, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Fires concurrent GET requests at a running server and reports throughput and latency, "
+        "to compare the WSGI and ASGI deployments under the same load"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="e.g. http://127.0.0.1:8000/api/posts/1/comments/")
+        parser.add_argument(
+            '--concurrency', default='1,10,50',
+            help="Comma-separated numbers of simultaneous clients")
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help="Requests per concurrency level")
+        parser.add_argument(
+            '--token',
+            help="JWT access token, for endpoints that require authentication")
+
+    def handle(self, *args, **options):
+        headers = {'Accept-Encoding': 'gzip'}
+        if options['token']:
+            headers['Authorization'] = f"Bearer {options['token']}"
+        count = options['requests']
+
+        for concurrency in (int(value) for value in options['concurrency'].split(',')):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                results = list(executor.map(
+                    lambda _: fetch(options['url'], headers), range(count)))
+            elapsed = time.perf_counter() - started
+
+            latencies = sorted(latency for ok, latency in results)
+            errors = sum(1 for ok, latency in results if not ok)
+            self.stdout.write(
+                f"concurrency {concurrency}: {count / elapsed:.0f} req/sec, "
+                f"p50 {percentile(latencies, 0.5) * 1000:.0f}ms, "
+                f"p95 {percentile(latencies, 0.95) * 1000:.0f}ms, {errors} errors")
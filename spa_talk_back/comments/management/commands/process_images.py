@@ -0,0 +1,40 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from comments.images import claim_jobs, process_jobs
+
+
+class Command(BaseCommand):
+    help = "Resizes uploaded post and comment images queued as ImageJob rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="Number of worker processes doing the resizing")
+        parser.add_argument(
+            '--batch-size', type=int, default=20,
+            help="How many jobs are claimed at a time")
+        parser.add_argument(
+            '--interval', type=float, default=2.0,
+            help="Seconds to wait before polling again when the queue is empty")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit as soon as the queue is empty")
+
+    def handle(self, *args, **options):
+        processed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                jobs = claim_jobs(options['batch_size'])
+                if jobs:
+                    processed += process_jobs(jobs, executor)
+                    self.stdout.write(f"Processed {len(jobs)} image job(s)")
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {processed} image job(s) processed"))
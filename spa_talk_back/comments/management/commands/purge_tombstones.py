@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from comments.models import Tombstone
+from comments.sync import SYNC_RETENTION
+
+
+class Command(BaseCommand):
+    help = "Deletes tombstones older than the ?since= sync retention, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="How many tombstones are deleted per statement")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - SYNC_RETENTION
+        deleted = 0
+        while True:
+            batch = list(
+                Tombstone.objects.filter(deleted_at__lt=cutoff)
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            deleted += Tombstone.objects.filter(pk__in=batch).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {deleted} tombstone(s) purged"))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from comments.models import Comment, Post
+
+
+def count_subquery(**filters):
+    counts = (
+        Comment.objects.filter(**filters)
+        .order_by()
+        .values(*filters.keys())
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+class Command(BaseCommand):
+    help = "Recounts Post.comments_count and Comment.reply_count and fixes any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many rows are out of sync")
+
+    def handle(self, *args, **options):
+        actual_comments = count_subquery(post=OuterRef('pk'))
+        actual_replies = count_subquery(parent=OuterRef('pk'))
+
+        with transaction.atomic():
+            posts = (
+                Post.objects.annotate(actual=actual_comments)
+                .exclude(comments_count=F('actual'))
+            )
+            comments = (
+                Comment.objects.annotate(actual=actual_replies)
+                .exclude(reply_count=F('actual'))
+            )
+            drifted_posts = list(posts.values_list('pk', flat=True))
+            drifted_comments = list(comments.values_list('pk', flat=True))
+
+            if not options['dry_run']:
+                Post.objects.filter(pk__in=drifted_posts).update(
+                    comments_count=count_subquery(post=OuterRef('pk')))
+                Comment.objects.filter(pk__in=drifted_comments).update(
+                    reply_count=count_subquery(parent=OuterRef('pk')))
+
+        verb = "Found" if options['dry_run'] else "Fixed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(drifted_posts)} post(s) and "
+            f"{len(drifted_comments)} comment(s) with drifted counters"))
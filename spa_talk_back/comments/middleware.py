@@ -0,0 +1,80 @@
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always there
+    brotli = None
+
+# API payloads only. HTML pages (admin, browsable API) carry CSRF tokens and
+# are left uncompressed, there is no BREACH padding here like GZipMiddleware
+# has; event streams have to reach the client as soon as they are written ↓
+COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack')
+
+
+def accepted_encodings(header):
+    """Codings of an Accept-Encoding header the client didn't refuse with q=0"""
+    codings = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        quality = params[2:] if params.startswith('q=') else '1'
+        try:
+            if float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        codings.add(coding.strip().lower())
+    return codings
+
+
+def compress(content, coding):
+    if coding == 'br':
+        return brotli.compress(content, quality=settings.API_BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=settings.API_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Brotli (when installed) or gzip compression of API responses larger than
+    API_COMPRESSION_MIN_SIZE, picked from the client's Accept-Encoding.
+    The levels are low on purpose: API payloads are compressed on every
+    request, a few percent of size isn't worth the extra milliseconds.
+
+    Like Django's GZipMiddleware, strong ETags are made weak since the
+    bytes differ per coding; If-None-Match is compared weakly anyway.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in COMPRESSIBLE_TYPES:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < settings.API_COMPRESSION_MIN_SIZE:
+            return response
+
+        codings = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in codings:
+            coding = 'br'
+        elif 'gzip' in codings:
+            coding = 'gzip'
+        else:
+            return response
+
+        compressed = compress(response.content, coding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        response.headers['Content-Encoding'] = coding
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
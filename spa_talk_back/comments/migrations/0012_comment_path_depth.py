@@ -0,0 +1,61 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:05
+
+from django.conf import settings
+from collections import defaultdict, deque
+
+from django.db import migrations, models
+
+
+PATH_STEP = 10
+
+
+# Fills path and depth for existing comments, walking each thread
+# breadth-first from its roots so parents are always resolved first ↓
+def backfill_comment_paths(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    rows = Comment.objects.values_list('id', 'parent_id')
+
+    children = defaultdict(list)
+    roots = []
+    for pk, parent_id in rows:
+        if parent_id is None:
+            roots.append(pk)
+        else:
+            children[parent_id].append(pk)
+
+    updated = []
+    queue = deque((pk, '', 0) for pk in roots)
+    while queue:
+        pk, parent_path, depth = queue.popleft()
+        path = f"{parent_path}{pk:0{PATH_STEP}d}/"
+        updated.append(Comment(id=pk, path=path, depth=depth))
+        for child in children.get(pk, ()):
+            queue.append((child, path, depth + 1))
+
+    Comment.objects.bulk_update(updated, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0011_alter_comment_file_alter_comment_image_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Nesting Level'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.TextField(blank=True, db_index=True, default='', editable=False, verbose_name='Thread Path'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+        migrations.RunPython(backfill_comment_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_comment_counters(apps, schema_editor):
+    Post = apps.get_model('comments', 'Post')
+    Comment = apps.get_model('comments', 'Comment')
+
+    def count_subquery(**filters):
+        counts = (
+            Comment.objects.filter(**filters)
+            .order_by()
+            .values(*filters.keys())
+            .annotate(total=Count('pk'))
+            .values('total')
+        )
+        return Coalesce(Subquery(counts), 0)
+
+    Post.objects.update(comments_count=count_subquery(post=OuterRef('pk')))
+    Comment.objects.update(reply_count=count_subquery(parent=OuterRef('pk')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0012_comment_path_depth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Replies Count'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Comments Count'),
+        ),
+        migrations.RunPython(backfill_comment_counters, migrations.RunPython.noop),
+    ]
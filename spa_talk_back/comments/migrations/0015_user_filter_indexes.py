@@ -0,0 +1,50 @@
+from django.db import migrations
+
+
+# PostViewSet filters posts by the author's username and email with
+# icontains (UPPER(col) LIKE UPPER('%value%')), istartswith and iexact.
+# On PostgreSQL the first one is served by pg_trgm GIN indexes and the
+# other two by btree indexes with text_pattern_ops, all on the same
+# UPPER(col) expression Django generates. auth_user belongs to another
+# app, so the indexes are created with plain SQL, concurrently to avoid
+# locking the table. Other databases (SQLite for local dev) skip this.
+USER_FILTER_COLUMNS = ['username', 'email']
+
+
+def create_user_filter_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in USER_FILTER_COLUMNS:
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS auth_user_{column}_upper_trgm "
+            f"ON auth_user USING gin ((UPPER({column}::text)) gin_trgm_ops)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS auth_user_{column}_upper_like "
+            f"ON auth_user ((UPPER({column}::text)) text_pattern_ops)"
+        )
+
+
+def drop_user_filter_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in USER_FILTER_COLUMNS:
+        schema_editor.execute(
+            f"DROP INDEX CONCURRENTLY IF EXISTS auth_user_{column}_upper_trgm")
+        schema_editor.execute(
+            f"DROP INDEX CONCURRENTLY IF EXISTS auth_user_{column}_upper_like")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('comments', '0014_post_created_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_user_filter_indexes, drop_user_filter_indexes),
+    ]
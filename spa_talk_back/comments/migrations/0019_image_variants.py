@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0018_image_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='image_meta',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Image Variants'),
+        ),
+        migrations.AddField(
+            model_name='imagejob',
+            name='meta',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_meta',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Image Variants'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='photo_meta',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Photo Variants'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='photo_status',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16, verbose_name='Photo Processing Status'),
+        ),
+    ]
@@ -1,14 +1,18 @@
 from django.contrib.auth.models import User
 from django.conf import settings
-from django.db import models
-from django.db.models.signals import post_save
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connections, models, router
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Greatest, Substr
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from PIL import Image
 from django.core.exceptions import ValidationError
 import os
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from io import BytesIO
-import sys
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from hashlib import sha256
 
 
 # Extending the standard User model, adding additional fields without changing User
@@ -19,10 +23,22 @@ class Profile(models.Model):
         upload_to='user_photos/', blank=True, null=True, verbose_name="Profile Photo")
     home_page = models.URLField(
         blank=True, null=True, verbose_name="Personal Home Page")
+    # Out-of-band processing of the photo: state, then dimensions,
+    # placeholder and responsive variants (see ImageJob) ↓
+    photo_status = models.CharField(
+        max_length=16, blank=True, default='', editable=False, verbose_name="Photo Processing Status")
+    photo_meta = models.JSONField(
+        blank=True, default=dict, editable=False, verbose_name="Photo Variants")
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+    def save(self, *args, **kwargs):
+        checksum = prepare_image_upload(self, 'photo')
+        super().save(*args, **kwargs)
+        if checksum:
+            queue_image_job(self, checksum, 'photo')
+
 
 # Django signal that is fired after a User is saved.
 @receiver(post_save, sender=User)
@@ -34,37 +50,31 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
         instance.profile.save()
 
 
-# Checks and resizes the uploaded image
+# Largest image, in pixels, accepted for processing. Guards the image
+# workers against decompression bombs
+MAX_IMAGE_PIXELS = 40_000_000
+IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF')
+
+
+# Checks the uploaded image. Only the header is read here, resizing happens
+# out of band in the image workers (see comments.images) ↓
 def validate_image_size(image):
-    if isinstance(image, InMemoryUploadedFile):
-        try:
-            with Image.open(image) as img:
-                if img.height > 240 or img.width > 320:
-                    output_size = (320, 240)
-                    img.thumbnail(output_size)
-
-                    output = BytesIO()
-
-                    if image.content_type == 'image/jpeg':
-                        img.save(output, format='JPEG', quality=85)
-                    elif image.content_type == 'image/png':
-                        img.save(output, format='PNG')
-                    elif image.content_type == 'image/gif':
-                        img.save(output, format='GIF')
-
-                    output.seek(0)
-                    return InMemoryUploadedFile(
-                        output,
-                        'ImageField',
-                        f"{image.name.split('.')[0]}_resized.{image.name.split('.')[-1]}",
-                        image.content_type,
-                        output.getbuffer().nbytes,
-                        None
-                    )
-            return image 
-        except Exception as e:
-            print(f"Error processing image: {e}")
-            raise ValidationError("Error processing image file")
+    if getattr(image, '_committed', False):
+        return  # already stored, nothing new to check
+    try:
+        with Image.open(image) as img:
+            image_format = img.format
+            width, height = img.size
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        raise ValidationError("Error processing image file")
+    finally:
+        image.seek(0)
+
+    if image_format not in IMAGE_FORMATS:
+        raise ValidationError('Only JPG, GIF and PNG images are allowed.')
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValidationError('Image dimensions are too large.')
 
 
 # Checks the extension of the file being downloaded
@@ -75,9 +85,13 @@ def validate_file_extension(value):
         raise ValidationError('Only TXT files are allowed.')
 
 
+# Largest attached .txt file, also enforced while uploading (see comments.uploads)
+MAX_TEXT_FILE_SIZE = 102400  # 100kb in bytes
+
+
 # Checks the size of the file being uploaded
 def validate_file_size(value):
-    if value.size > 102400:  # 100kb in bytes
+    if value.size > MAX_TEXT_FILE_SIZE:
         raise ValidationError('File size cannot exceed 100KB.')
 
 
@@ -106,24 +120,37 @@ class Post(models.Model):
         auto_now_add=True, verbose_name="Creation Date")
     updated_at = models.DateTimeField(
         auto_now=True, verbose_name="Last Update")
+    # Out-of-band processing of the image: state, then dimensions,
+    # placeholder and responsive variants (see ImageJob) ↓
+    image_status = models.CharField(
+        max_length=16, blank=True, default='', editable=False, verbose_name="Image Processing Status")
+    image_meta = models.JSONField(
+        blank=True, default=dict, editable=False, verbose_name="Image Variants")
+    # Full-text index of the text, PostgreSQL only (see update_search_vector) ↓
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Kept up to date by the comment signals below ↓
+    comments_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Comments Count")
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = "Post"
         verbose_name_plural = "Posts"
+        indexes = [
+            # Keyset pagination of the feed ↓
+            models.Index(fields=['created_at', 'id'], name='post_created_id_idx'),
+            # ?since= delta sync (comments.sync) ↓
+            models.Index(fields=['updated_at'], name='post_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Post by {self.user.username} at {self.created_at}"
 
     def save(self, *args, **kwargs):
-        if self.image:
-            try:
-                processed_image = validate_image_size(self.image)
-                if processed_image and processed_image != self.image:
-                    self.image = processed_image
-            except Exception as e:
-                print(f"Error processing image: {e}")
+        checksum = prepare_image_upload(self)
         super().save(*args, **kwargs)
+        if checksum:
+            queue_image_job(self, checksum)
 
     @property
     def image_url(self):
@@ -132,7 +159,23 @@ class Post(models.Model):
         return None
 
 
+class CommentQuerySet(models.QuerySet):
+    # Comment itself and all replies below it, one range scan on the path index ↓
+    def subtree_of(self, comment, include_self=True):
+        queryset = self.filter(path__startswith=comment.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=comment.pk)
+        return queryset
+
+    # Every comment above the given one, from the thread root down ↓
+    def ancestors_of(self, comment):
+        return self.filter(pk__in=comment.ancestor_ids).order_by('depth')
+
+
 class Comment(models.Model):
+    # Width of one zero-padded id segment in the materialized path
+    PATH_STEP = 10
+
     post = models.ForeignKey(
         Post, related_name="comments", on_delete=models.CASCADE, verbose_name="Related Post"
     )
@@ -162,11 +205,39 @@ class Comment(models.Model):
         validators=[validate_file_extension, validate_file_size],
         verbose_name="Attached File"
     )
+    # Materialized path of ids from the thread root down to this comment,
+    # e.g. "0000000003/0000000017/", and the nesting level it implies ↓
+    path = models.TextField(
+        blank=True, default='', editable=False, db_index=True, verbose_name="Thread Path")
+    depth = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Nesting Level")
+    # Out-of-band processing of the image: state, then dimensions,
+    # placeholder and responsive variants (see ImageJob) ↓
+    image_status = models.CharField(
+        max_length=16, blank=True, default='', editable=False, verbose_name="Image Processing Status")
+    image_meta = models.JSONField(
+        blank=True, default=dict, editable=False, verbose_name="Image Variants")
+    # Full-text index of the text, PostgreSQL only (see update_search_vector) ↓
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Number of direct replies, kept up to date by the signals below ↓
+    reply_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Replies Count")
+
+    objects = CommentQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = "Comment"
         verbose_name_plural = "Comments"
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+            # Paging through the roots of a thread and the replies of a comment ↓
+            models.Index(fields=['post', 'created_at', 'id'], condition=Q(parent__isnull=True),
+                         name='comment_post_roots_idx'),
+            models.Index(fields=['parent', 'created_at', 'id'], name='comment_parent_created_idx'),
+            # ?since= delta sync of a thread (comments.sync) ↓
+            models.Index(fields=['post', 'updated_at'], name='comment_post_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.post} at {self.created_at}"
@@ -177,14 +248,202 @@ class Comment(models.Model):
         """Check if this comment is a reply to another comment."""
         return self.parent is not None
 
-    # Process the image before saving ↓
+    @classmethod
+    def build_path(cls, parent_path, pk):
+        return f"{parent_path}{pk:0{cls.PATH_STEP}d}/"
+
+    @property
+    def ancestor_ids(self):
+        return [int(segment) for segment in self.path.split('/')[:-2]]
+
+    # Queue the image for resizing after saving ↓
     def save(self, *args, **kwargs):
-        if self.image:
-            try:
-                processed_image = validate_image_size(self.image)
-                if processed_image != self.image:
-                    self.image = processed_image
-            except Exception as e:
-                print(f"Error saving comment image: {e}")
-                raise
+        checksum = prepare_image_upload(self)
+        self.depth = self.parent.depth + 1 if self.parent_id else 0
         super().save(*args, **kwargs)
+        self.update_path()
+        if checksum:
+            queue_image_job(self, checksum)
+
+    # The path needs the primary key, so it is written right after the insert.
+    # If the comment was moved under another parent, its replies move with it ↓
+    def update_path(self):
+        parent_path = self.parent.path if self.parent_id else ''
+        path = self.build_path(parent_path, self.pk)
+        if path == self.path:
+            return
+
+        old_path = self.path
+        Comment.objects.filter(pk=self.pk).update(path=path)
+        if old_path:
+            old_ancestors = [int(segment) for segment in old_path.split('/')[:-2]]
+            if old_ancestors:
+                adjust_reply_count(old_ancestors[-1], -1)
+            if self.parent_id:
+                adjust_reply_count(self.parent_id, 1)
+
+            old_depth = old_path.count('/') - 1
+            Comment.objects.subtree_of(self, include_self=False).update(
+                path=Concat(Value(path), Substr('path', len(old_path) + 1),
+                            output_field=models.TextField()),
+                depth=F('depth') + (self.depth - old_depth)
+            )
+        self.path = path
+
+
+# Resizing of an uploaded image and generation of its variants, done by the image workers
+# (python manage.py process_images) instead of the request ↓
+class ImageJob(models.Model):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    target = GenericForeignKey('content_type', 'object_id')
+    field_name = models.CharField(max_length=32, default='image')
+    # Stored original and its content hash, equal uploads are processed once ↓
+    source = models.CharField(max_length=255)
+    checksum = models.CharField(max_length=64, db_index=True)
+    result = models.CharField(max_length=255, blank=True, default='')
+    # Dimensions, placeholder hash and variants of the result, copied to the object ↓
+    meta = models.JSONField(blank=True, default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = "Image Job"
+        verbose_name_plural = "Image Jobs"
+        indexes = [
+            models.Index(fields=['status', 'id'], name='imagejob_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.status} job for {self.source}"
+
+
+# Record of a deleted post or comment, so ?since= delta sync can tell
+# clients what to drop (see comments.sync) ↓
+class Tombstone(models.Model):
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    # The post itself, or the post the comment belonged to
+    post_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['deleted_at']
+        verbose_name = "Tombstone"
+        verbose_name_plural = "Tombstones"
+        indexes = [
+            models.Index(fields=['content_type', 'deleted_at'], name='tombstone_deleted_idx'),
+            models.Index(fields=['content_type', 'post_id', 'deleted_at'],
+                         name='tombstone_post_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deleted {self.content_type.model} {self.object_id}"
+
+
+def file_checksum(file):
+    digest = sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+# A new upload is stored as is right away and marked pending. If the same
+# content was already processed, that result is reused and nothing is stored.
+# Returns the checksum when a job has to be queued ↓
+def prepare_image_upload(instance, field_name='image'):
+    image = getattr(instance, field_name)
+    if not image or image._committed:
+        return None
+
+    checksum = file_checksum(image)
+    processed = (
+        ImageJob.objects.filter(checksum=checksum, field_name=field_name, status=ImageJob.DONE)
+        .exclude(result='')
+        .first()
+    )
+    if processed:
+        setattr(instance, field_name, processed.result)
+        setattr(instance, f'{field_name}_status', ImageJob.DONE)
+        setattr(instance, f'{field_name}_meta', processed.meta)
+        return None
+    setattr(instance, f'{field_name}_status', ImageJob.PENDING)
+    setattr(instance, f'{field_name}_meta', {})
+    return checksum
+
+
+def queue_image_job(instance, checksum, field_name='image'):
+    ImageJob.objects.create(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_id=instance.pk,
+        field_name=field_name,
+        source=getattr(instance, field_name).name,
+        checksum=checksum,
+    )
+
+
+# Counters are changed with a single UPDATE ... SET count = count ± 1, so
+# concurrent commenters never read-modify-write the same value and the row
+# lock is only held for that one statement ↓
+def adjust_comments_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=Greatest(F('comments_count') + delta, 0))
+
+
+def adjust_reply_count(comment_id, delta):
+    Comment.objects.filter(pk=comment_id).update(
+        reply_count=Greatest(F('reply_count') + delta, 0))
+
+
+@receiver(post_save, sender=Comment)
+def increment_comment_counters(sender, instance, created, **kwargs):
+    if created:
+        adjust_comments_count(instance.post_id, 1)
+        if instance.parent_id:
+            adjust_reply_count(instance.parent_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_counters(sender, instance, origin=None, **kwargs):
+    # The whole post is going away, there is nothing left to count
+    if isinstance(origin, Post) or getattr(origin, 'model', None) is Post:
+        return
+    adjust_comments_count(instance.post_id, -1)
+    if instance.parent_id:
+        adjust_reply_count(instance.parent_id, -1)
+
+
+# Text search configuration used for the stored vectors and the queries
+SEARCH_CONFIG = 'english'
+
+
+# Recomputes the stored tsvector of a post or comment in the database.
+# Other backends have no tsvector, comments.search falls back to LIKE there ↓
+def update_search_vector(model, pk):
+    if connections[router.db_for_write(model)].vendor != 'postgresql':
+        return
+    model.objects.filter(pk=pk).update(
+        search_vector=SearchVector('text', config=SEARCH_CONFIG))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+def refresh_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'text' in update_fields:
+        update_search_vector(sender, instance.pk)
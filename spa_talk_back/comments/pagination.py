@@ -0,0 +1,156 @@
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (ordering_field, pk).
+
+    Each page is fetched with a range condition on the last row seen instead
+    of an OFFSET, and no COUNT(*) is run, so deep pages cost the same as the
+    first one as long as an index on (ordering_field, id) exists. The cursor
+    is an opaque token with the position of the first or last row of the
+    current page and the direction to walk from it.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = None
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_field = 'created_at'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def is_descending(self, request):
+        return True
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def parse_position(self, queryset, raw):
+        field = queryset.model._meta.get_field(self.ordering_field)
+        return field.to_python(raw)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            value = self.parse_position(queryset, tokens['p'][0])
+            pk = int(tokens['i'][0])
+            reverse = tokens.get('r', ['0'])[0] == '1'
+        except (TypeError, ValueError, KeyError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk, reverse
+
+    def encode_cursor(self, obj, reverse, base_url=None):
+        value = getattr(obj, self.ordering_field)
+        value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        tokens = {'p': value, 'i': obj.pk}
+        if reverse:
+            tokens['r'] = '1'
+        querystring = parse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(base_url or self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset)
+        reverse = cursor[2] if cursor else False
+
+        # Walking back to the previous page scans the index the other way ↓
+        field = self.ordering_field
+        descending = self.is_descending(request) != reverse
+        if descending:
+            queryset = queryset.order_by(f'-{field}', '-pk')
+        else:
+            queryset = queryset.order_by(field, 'pk')
+
+        if cursor:
+            value, pk, _ = cursor
+            lookup = 'lt' if descending else 'gt'
+            # (field, pk) < (value, pk) written so the leading column is a plain range
+            queryset = queryset.filter(**{f'{field}__{lookup}e': value}).filter(
+                Q(**{f'{field}__{lookup}': value}) | Q(**{f'pk__{lookup}': pk}))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_more if not reverse else cursor is not None
+        self.has_previous = cursor is not None if not reverse else has_more
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+# The posts feed follows ?date_order the same way
+# PostViewSet.get_queryset does in page-number mode ↓
+class PostCursorPagination(KeysetPagination):
+    page_size_query_param = 'page_size'
+
+    def is_descending(self, request):
+        date_order = request.query_params.get('date_order')
+        return not date_order or date_order == 'desc'
+
+
+# Comment threads page through roots or replies newest first,
+# like the Comment.Meta ordering ↓
+class CommentCursorPagination(KeysetPagination):
+    page_size_query_param = 'page_size'
+
+
+# Search hits are ordered by their rank annotation, best first ↓
+class SearchCursorPagination(KeysetPagination):
+    page_size_query_param = 'page_size'
+    ordering_field = 'rank'
+
+    def parse_position(self, queryset, raw):
+        return float(raw)
@@ -0,0 +1,81 @@
+import threading
+from collections import Counter
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+class ConnectionStats:
+    """
+    Per-process count of database connects by alias: new connections
+    without a pool, checkouts from the pool with DATABASE_POOL=pool
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = Counter()
+
+    def count(self, alias):
+        with self.lock:
+            self.connects[alias] += 1
+
+
+connection_stats = ConnectionStats()
+
+
+@receiver(connection_created)
+def count_connect(sender, connection, **kwargs):
+    connection_stats.count(connection.alias)
+
+
+def pool_stats(connection):
+    """Saturation, waits and checkouts of the psycopg pool of a connection, None without one"""
+    pool = getattr(connection, 'pool', None)
+    if pool is None:
+        return None
+    # psycopg_pool leaves out the counters that are still zero ↓
+    stats = pool.get_stats()
+    size = stats.get('pool_size', 0)
+    max_size = stats.get('pool_max', 0)
+    # Django only opens the pool on the first query of the process ↓
+    in_use = 0 if pool.closed else size - stats.get('pool_available', 0)
+    queued = stats.get('requests_queued', 0)
+    wait_ms = stats.get('requests_wait_ms', 0)
+    return {
+        'min_size': stats.get('pool_min', 0),
+        'max_size': max_size,
+        'size': size,
+        'in_use': in_use,
+        'saturation': round(in_use / max_size, 2) if max_size else 0,
+        'waiting': stats.get('requests_waiting', 0),
+        'checkouts': stats.get('requests_num', 0),
+        'queued_checkouts': queued,
+        'wait_ms': wait_ms,
+        'average_wait_ms': round(wait_ms / queued, 1) if queued else 0,
+        'failed_checkouts': stats.get('requests_errors', 0),
+        'connections_opened': stats.get('connections_num', 0),
+        'connections_lost': stats.get('connections_lost', 0),
+        'bad_returns': stats.get('returns_bad', 0),
+    }
+
+
+def connection_mode(settings_dict):
+    if settings_dict.get('OPTIONS', {}).get('pool'):
+        return 'pool'
+    if settings_dict.get('CONN_MAX_AGE'):
+        return 'persistent'
+    return 'per-request'
+
+
+def database_stats():
+    """Connection numbers of every database alias, shown by StatsView"""
+    stats = {}
+    for alias in connections:
+        connection = connections[alias]
+        stats[alias] = {
+            'mode': connection_mode(connection.settings_dict),
+            'connects': connection_stats.connects[alias],
+            'pool': pool_stats(connection),
+        }
+    return stats
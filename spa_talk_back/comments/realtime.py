@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Comment, Post
+
+# Seconds between keep-alive comments of an idle event stream, proxies
+# tend to close connections that stay silent for a minute ↓
+SSE_KEEPALIVE = 20
+
+
+def post_comments_group(post_id):
+    return f"post.{post_id}.comments"
+
+
+def file_url(file):
+    return file.url if file else None
+
+
+def comment_delta(comment):
+    """
+    Everything a client needs to insert the comment into a thread it
+    already shows, without a request to the API. URLs are relative to the
+    API host (or absolute on S3), like the media paths the frontend gets.
+    """
+    profile = getattr(comment.user, 'profile', None)
+    delta = {
+        'id': comment.pk,
+        'post': comment.post_id,
+        'parent': comment.parent_id,
+        'level': comment.depth,
+        'text': comment.text,
+        'created_at': comment.created_at,
+        'updated_at': comment.updated_at,
+        'image': file_url(comment.image),
+        'image_status': comment.image_status,
+        'file': file_url(comment.file),
+        'reply_count': comment.reply_count,
+        'user': {
+            'id': comment.user_id,
+            'username': comment.user.username,
+            'profile': {
+                'photo_url': file_url(profile.photo) if profile else None,
+            },
+        },
+        'parent_info': None,
+    }
+    if comment.parent_id:
+        parent = comment.parent
+        delta['parent_info'] = {
+            'id': parent.pk,
+            'text': parent.text,
+            'username': parent.user.username,
+        }
+    return delta
+
+
+def publish_comment_event(post_id, event, delta):
+    """Fans the delta out to every WebSocket and event stream of the post"""
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    async_to_sync(layer.group_send)(post_comments_group(post_id), {
+        'type': 'comment.event',
+        'event': event,
+        'delta': json.loads(json.dumps(delta, cls=DjangoJSONEncoder)),
+    })
+
+
+# Events go out once the transaction is committed, so subscribers never
+# see a comment that was rolled back. The comment is saved by then: an
+# unreachable channel layer is logged (robust) instead of failing the request ↓
+@receiver(post_save, sender=Comment)
+def push_created_comment(sender, instance, created, **kwargs):
+    if created:
+        delta = comment_delta(instance)
+        transaction.on_commit(
+            lambda: publish_comment_event(instance.post_id, 'created', delta), robust=True)
+
+
+@receiver(post_delete, sender=Comment)
+def push_deleted_comment(sender, instance, origin=None, **kwargs):
+    # The whole post is going away, its page goes with it
+    if isinstance(origin, Post) or getattr(origin, 'model', None) is Post:
+        return
+    delta = {'id': instance.pk, 'post': instance.post_id, 'parent': instance.parent_id}
+    transaction.on_commit(
+        lambda: publish_comment_event(instance.post_id, 'deleted', delta), robust=True)
+
+
+async def comment_event_stream(post_id):
+    """
+    Server-Sent Events of a post's comments, the fallback for clients
+    that can't open a WebSocket. Each subscriber gets its own channel in
+    the post's group, like a consumer would.
+    """
+    layer = get_channel_layer()
+    group = post_comments_group(post_id)
+    channel = await layer.new_channel()
+    await layer.group_add(group, channel)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                message = await asyncio.wait_for(layer.receive(channel), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield f"event: {message['event']}\ndata: {json.dumps(message['delta'])}\n\n"
+    finally:
+        await layer.group_discard(group, channel)
@@ -0,0 +1,47 @@
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Types orjson doesn't know (Decimal, lazy strings, querysets...) go through
+# DRF's encoder, the same one JSONRenderer uses ↓
+encode_default = JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer producing the same compact UTF-8 output with orjson,
+    several times faster on large threads. Indented output (?indent or the
+    browsable API) is still left to the standard renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # orjson writes datetimes itself, OPT_UTC_Z gives them the 'Z' suffix
+        # DRF's encoder uses instead of '+00:00' ↓
+        ret = orjson.dumps(data, default=encode_default, option=orjson.OPT_UTC_Z)
+        # Like JSONRenderer, keep the output valid as JavaScript ↓
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack for mobile and service clients (Accept: application/msgpack
+    or ?format=msgpack). Same structure as the JSON output, but datetimes
+    are msgpack timestamps instead of ISO strings (see Fieldset).
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    native_datetimes = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, datetime=True)
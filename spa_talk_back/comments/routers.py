@@ -0,0 +1,92 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_started
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+
+# Set while a view that may read from a replica handles a safe request,
+# every query of that request (in any thread it spawns) sees it ↓
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+@receiver(request_started)
+def reset_replica_reads(sender, **kwargs):
+    # A request that died before finalize_response must not leave the
+    # next request of the same thread on the replicas ↓
+    replica_reads.set(False)
+
+
+def pin_key(request):
+    """Who a write is remembered for: the user, or the session of an anonymous visitor"""
+    if request.user.is_authenticated:
+        return f"replica:pinned:user:{request.user.pk}"
+    session_key = getattr(request, 'session', None) and request.session.session_key
+    return f"replica:pinned:session:{session_key}" if session_key else None
+
+
+def pin_primary(request):
+    """Reads of whoever just wrote stay on the primary until the replicas caught up"""
+    key = pin_key(request)
+    if key:
+        caches[settings.API_CACHE_ALIAS].set(key, True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    key = pin_key(request)
+    return bool(key) and caches[settings.API_CACHE_ALIAS].get(key, False)
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of replica_reads requests to a random replica of
+    REPLICA_DATABASES; everything else, and all writes, go to default
+    """
+
+    def db_for_read(self, model, **hints):
+        if replica_reads.get() and settings.REPLICA_DATABASES:
+            return random.choice(settings.REPLICA_DATABASES)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as default ↓
+        databases = {'default', *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from default through replication ↓
+        return db not in settings.REPLICA_DATABASES
+
+
+class ReplicaReadMixin:
+    """
+    Safe requests of the view read from the replicas, unless the user (or
+    session) wrote something in the last REPLICA_PIN_SECONDS. Successful
+    writes through the view start that window.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            settings.REPLICA_DATABASES
+            and request.method in SAFE_METHODS
+            and not is_pinned(request)
+        ):
+            replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        replica_reads.set(False)
+        if (
+            settings.REPLICA_DATABASES
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+        ):
+            pin_primary(request)
+        return super().finalize_response(request, response, *args, **kwargs)
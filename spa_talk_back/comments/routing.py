@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import PostCommentsConsumer
+
+websocket_urlpatterns = [
+    path('ws/posts/<int:post_id>/comments/', PostCommentsConsumer.as_asgi()),
+]
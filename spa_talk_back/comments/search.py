@@ -0,0 +1,85 @@
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import connections, router
+from django.db.models import F, FloatField, Max, OuterRef, Q, Subquery, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from .models import SEARCH_CONFIG, Comment, Post
+
+# How many matching comments are shown under each post hit
+SNIPPETS_PER_POST = 3
+
+
+def uses_full_text(model):
+    """
+    Stored tsvectors exist only on PostgreSQL, other databases
+    (SQLite for local dev) fall back to a plain LIKE search
+    """
+    return connections[router.db_for_read(model)].vendor == 'postgresql'
+
+
+def build_query(text):
+    return SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+
+
+def search_posts(text):
+    """
+    Posts whose own text or any comment matches, annotated with `rank`
+    (post rank plus its best comment rank) and a highlighted `headline`
+    """
+    if not uses_full_text(Post):
+        matching = Comment.objects.filter(text__icontains=text).values('post_id')
+        return Post.objects.filter(Q(text__icontains=text) | Q(pk__in=matching)).annotate(
+            rank=Value(0.0, output_field=FloatField()),
+            headline=F('text'),
+        )
+
+    query = build_query(text)
+    best_comment_rank = (
+        Comment.objects.filter(post=OuterRef('pk'), search_vector=query)
+        .order_by()
+        .values('post')
+        .annotate(best=Max(SearchRank(F('search_vector'), query)))
+        .values('best')
+    )
+    matching = Comment.objects.filter(search_vector=query).values('post_id')
+    return Post.objects.filter(Q(search_vector=query) | Q(pk__in=matching)).annotate(
+        rank=(
+            Coalesce(SearchRank(F('search_vector'), query), Value(0.0))
+            + Coalesce(Subquery(best_comment_rank), Value(0.0))
+        ),
+        headline=SearchHeadline('text', query, config=SEARCH_CONFIG),
+    )
+
+
+def matching_comment_snippets(post_ids, text, limit=SNIPPETS_PER_POST):
+    """
+    Best matching comments of the given posts, at most `limit` per post,
+    fetched in one query with ROW_NUMBER() OVER (PARTITION BY post_id)
+    """
+    comments = Comment.objects.filter(post_id__in=post_ids)
+    if uses_full_text(Comment):
+        query = build_query(text)
+        rank = SearchRank(F('search_vector'), query)
+        comments = comments.filter(search_vector=query).annotate(
+            snippet=SearchHeadline('text', query, config=SEARCH_CONFIG),
+            position=Window(RowNumber(), partition_by=F('post_id'), order_by=rank.desc()),
+        )
+    else:
+        comments = comments.filter(text__icontains=text).annotate(
+            snippet=F('text'),
+            position=Window(RowNumber(), partition_by=F('post_id'),
+                            order_by=F('created_at').desc()),
+        )
+
+    snippets = {}
+    rows = comments.filter(position__lte=limit).order_by('post_id', 'position').values(
+        'id', 'post_id', 'parent_id', 'user__username', 'snippet', 'created_at')
+    for row in rows:
+        snippets.setdefault(row['post_id'], []).append({
+            'id': row['id'],
+            'parent': row['parent_id'],
+            'username': row['user__username'],
+            'snippet': row['snippet'],
+            'created_at': row['created_at'],
+        })
+    return snippets
@@ -1,14 +1,42 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from .cache import cached_author
+from .fieldsets import SparseFieldsMixin
 from .models import Profile, Post, Comment
 
 
+# Responsive variants of a processed image (see comments.images): the size
+# and placeholder to lay the page out with, and a srcset to pick from ↓
+def image_variants(obj, field_name, request):
+    meta = getattr(obj, f'{field_name}_meta')
+    if not meta or not getattr(obj, field_name):
+        return None
+    storage = getattr(obj, field_name).storage
+    srcset = []
+    for variant in meta.get('variants', []):
+        url = storage.url(variant['name'])
+        srcset.append({
+            'url': request.build_absolute_uri(url) if request else url,
+            'width': variant['width'],
+            'height': variant['height'],
+            'type': variant['type'],
+        })
+    return {
+        'width': meta.get('width'),
+        'height': meta.get('height'),
+        'placeholder': meta.get('placeholder'),
+        'srcset': srcset,
+    }
+
+
 class ProfileSerializer(serializers.ModelSerializer):
     photo_url = serializers.SerializerMethodField()
+    photo_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Profile
-        fields = ['photo', 'photo_url', 'home_page']
+        fields = ['photo', 'photo_url', 'photo_status', 'photo_variants', 'home_page']
+        read_only_fields = ['photo_status']
 
     def get_photo_url(self, obj):
         request = self.context.get('request')
@@ -16,8 +44,11 @@ class ProfileSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.photo.url)
         return request.build_absolute_uri('/media/user_photos/default.jpg')
 
+    def get_photo_variants(self, obj):
+        return image_variants(obj, 'photo', self.context.get('request'))
+
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     profile = ProfileSerializer(required=False)
 
     class Meta:
@@ -66,24 +97,61 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
 
-class PostSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
-    comments_count = serializers.SerializerMethodField()
+# Author of a post or comment. The rendered fragment is cached per user
+# (see comments.cache), so a page with a handful of authors renders each once.
+# With ?author=compact only the id, username and photo URL are rendered, and
+# with a UserMap in the context only the id, the author goes to the map ↓
+class AuthorSerializer(UserSerializer):
+    def to_representation(self, instance):
+        users = self.context.get('users')
+        if users is not None:
+            return users.add(instance.pk, lambda: self.render(instance))
+        return self.render(instance)
+
+    def render(self, instance):
+        request = self.context.get('request')
+        fieldset = self.context.get('fieldset')
+        if fieldset is not None and fieldset.compact_author:
+            return cached_author(instance.pk, request, lambda: self.compact(instance), 'compact')
+        return cached_author(
+            instance.pk,
+            request,
+            lambda: super(AuthorSerializer, self).to_representation(instance)
+        )
+
+    def compact(self, instance):
+        return {
+            'id': instance.pk,
+            'username': instance.username,
+            'photo_url': ProfileSerializer(context=self.context).get_photo_url(instance.profile),
+        }
+
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    user = AuthorSerializer(read_only=True)
+    comments_count = serializers.IntegerField(read_only=True)
     image_url = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id', 'text', 'user', 'image', 'image_url', 'file', 'created_at', 'updated_at', 'comments_count']
-        read_only_fields = ['user', 'created_at', 'updated_at']
+        fields = ['id', 'text', 'user', 'image', 'image_url', 'image_status', 'image_variants', 'file',
+                  'created_at', 'updated_at', 'comments_count']
+        read_only_fields = ['user', 'created_at', 'updated_at', 'image_status']
+        # Columns loaded for ?fields= / ?omit= (see Fieldset.trim): created_at
+        # orders every post list, the other two make up a post's ETag ↓
+        sparse_always = ('id', 'created_at', 'updated_at', 'comments_count')
+        sparse_sources = {
+            'user': lambda fieldset: fieldset.author_columns('user'),
+            'image_url': ['image'],
+            'image_variants': ['image', 'image_meta'],
+        }
 
     def create(self, validated_data):
         user = self.context['request'].user
         validated_data['user'] = user
         return super().create(validated_data)
 
-    def get_comments_count(self, obj):
-        return Comment.objects.filter(post=obj).count()  
-
     def get_image_url(self, obj):
         if obj.image:
             request = self.context.get('request')
@@ -92,20 +160,75 @@ class PostSerializer(serializers.ModelSerializer):
             return obj.image.url
         return None
 
+    def get_image_variants(self, obj):
+        return image_variants(obj, 'image', self.context.get('request'))
+
+
+# A post of the list with its latest top-level comments embedded (?embed_comments=N),
+# loaded for the whole page at once and passed in the context as {post_id: [node, ...]} ↓
+class PostWithCommentsSerializer(PostSerializer):
+    latest_comments = serializers.SerializerMethodField()
+
+    class Meta(PostSerializer.Meta):
+        fields = PostSerializer.Meta.fields + ['latest_comments']
+
+    def get_latest_comments(self, obj):
+        return self.context.get('comment_previews', {}).get(obj.pk, [])
 
-class CommentSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+
+# A post hit of the search endpoint, the matching comments of the
+# current page are passed in the context as {post_id: [snippet, ...]} ↓
+class PostSearchSerializer(PostSerializer):
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.CharField(read_only=True)
+    matching_comments = serializers.SerializerMethodField()
+
+    class Meta(PostSerializer.Meta):
+        fields = PostSerializer.Meta.fields + ['rank', 'headline', 'matching_comments']
+
+    def get_matching_comments(self, obj):
+        return self.context.get('snippets', {}).get(obj.pk, [])
+
+
+# Plain comment fields without the thread-related ones,
+# comments.tree.CommentTree fills those in from its in-memory map ↓
+class CommentNodeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    user = AuthorSerializer(read_only=True)
+    image_variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'post', 'user', 'text', 'created_at', 'updated_at',
+                  'image', 'image_status', 'image_variants', 'file', 'parent', 'reply_count']
+        read_only_fields = ['user', 'created_at', 'updated_at', 'image_status', 'reply_count']
+        # The thread builders and cursors always need the tree columns ↓
+        sparse_always = ('id', 'post', 'parent', 'path', 'depth', 'created_at', 'reply_count')
+        sparse_sources = {
+            'user': lambda fieldset: fieldset.author_columns('user'),
+            'image_variants': ['image', 'image_meta'],
+        }
+
+    def get_image_variants(self, obj):
+        return image_variants(obj, 'image', self.context.get('request'))
+
+
+class CommentSerializer(CommentNodeSerializer):
     replies = serializers.SerializerMethodField()
     level = serializers.SerializerMethodField()
     parent_text = serializers.SerializerMethodField()
     parent_info = serializers.SerializerMethodField()  
 
-    class Meta:
-        model = Comment
-        fields = ['id', 'post', 'user', 'text', 'created_at', 'updated_at', 
-                 'image', 'file', 'parent', 'replies', 'level', 'parent_text',
-                 'parent_info']
-        read_only_fields = ['user', 'created_at', 'updated_at']
+    class Meta(CommentNodeSerializer.Meta):
+        fields = CommentNodeSerializer.Meta.fields + [
+            'replies', 'level', 'parent_text', 'parent_info']
+        sparse_sources = {
+            **CommentNodeSerializer.Meta.sparse_sources,
+            'replies': [],
+            'level': [],
+            # Read through obj.parent, so joined in ↓
+            'parent_text': ['parent__text'],
+            'parent_info': ['parent__text', 'parent__user__username'],
+        }
 
     def get_replies(self, obj):
         if obj.replies.exists():
@@ -114,12 +237,7 @@ class CommentSerializer(serializers.ModelSerializer):
         return []
 
     def get_level(self, obj):
-        level = 0
-        parent = obj.parent
-        while parent is not None:
-            level += 1
-            parent = parent.parent
-        return level
+        return obj.depth
 
     def get_parent_text(self, obj):
         if obj.parent:
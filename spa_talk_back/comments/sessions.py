@@ -0,0 +1,90 @@
+import threading
+
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+
+class SessionStats:
+    """Per-process counters of the session engine, shown by StatsView"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.skipped_writes = 0
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'skipped_writes': self.skipped_writes,
+        }
+
+
+session_stats = SessionStats()
+
+
+class SessionStore(CachedDBStore):
+    """
+    Sessions read from the SESSION_CACHE_ALIAS cache and written through to
+    the database only when their data changed.
+
+    Django already skips saving sessions nobody touched; this also skips
+    saves of sessions that were marked modified but hold what was loaded
+    (e.g. forced request.session.save() calls or a value set to itself).
+    """
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self.loaded_data = None
+
+    def snapshot(self, data):
+        return self.serializer().dumps(data)
+
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            # Some backends (e.g. memcache) raise an exception on invalid
+            # cache keys. If this happens, reset the session ↓
+            data = None
+
+        if data is None:
+            session_stats.count('misses')
+            session = self._get_session_from_db()
+            if session:
+                data = self.decode(session.session_data)
+                self._cache.set(
+                    self.cache_key, data, self.get_expiry_age(expiry=session.expire_date))
+            else:
+                data = {}
+        else:
+            session_stats.count('hits')
+
+        if data:
+            self.loaded_data = self.snapshot(data)
+        return data
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        if (
+            not must_create
+            and self.loaded_data is not None
+            and self.snapshot(data) == self.loaded_data
+        ):
+            session_stats.count('skipped_writes')
+            return
+        super().save(must_create)
+        session_stats.count('writes')
+        self.loaded_data = self.snapshot(data)
+
+    def delete(self, session_key=None):
+        super().delete(session_key)
+        self.loaded_data = None
@@ -0,0 +1,113 @@
+from base64 import b64decode, b64encode
+from datetime import timedelta
+from urllib import parse
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import APIException, ParseError
+
+from .models import Comment, Post, Tombstone
+
+# Rows committed late (a long transaction) can carry an updated_at older than
+# a cursor handed out meanwhile, so each sync looks this far behind its
+# cursor. Clients upsert by id, seeing a row twice is harmless ↓
+SYNC_OVERLAP = timedelta(seconds=5)
+# Tombstones older than this are purged (manage.py purge_tombstones),
+# older cursors have to reload the full list
+SYNC_RETENTION = timedelta(days=30)
+# Larger deltas are answered with 410, a full reload is cheaper then
+SYNC_LIMIT = 1000
+
+SYNC_CURSOR_HEADER = 'X-Sync-Cursor'
+
+
+class SyncExpired(APIException):
+    status_code = 410
+    default_detail = 'Too many changes or cursor too old, reload the full list.'
+    default_code = 'sync_expired'
+
+
+def encode_sync_cursor(moment):
+    querystring = parse.urlencode({'t': moment.isoformat()})
+    return b64encode(querystring.encode('ascii')).decode('ascii')
+
+
+def decode_sync_cursor(encoded):
+    try:
+        querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+        moment = parse_datetime(parse.parse_qs(querystring)['t'][0])
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        moment = None
+    # Cursors handed out are always aware, a naive one can't be compared ↓
+    if moment is None or timezone.is_naive(moment):
+        raise ParseError('Invalid sync cursor')
+    if moment < timezone.now() - SYNC_RETENTION:
+        raise SyncExpired()
+    return moment
+
+
+def set_sync_cursor(response, moment):
+    """The cursor a client passes as ?since= to get what changed after `moment`"""
+    response.headers[SYNC_CURSOR_HEADER] = encode_sync_cursor(moment)
+    return response
+
+
+def changes_since(changed, deleted):
+    """Changed rows and deleted ids of a sync window, at most SYNC_LIMIT of each"""
+    rows = list(changed.order_by('updated_at', 'pk')[:SYNC_LIMIT + 1])
+    deleted_ids = list(
+        deleted.order_by('deleted_at').values_list('object_id', flat=True)[:SYNC_LIMIT + 1])
+    if len(rows) > SYNC_LIMIT or len(deleted_ids) > SYNC_LIMIT:
+        raise SyncExpired()
+    return rows, deleted_ids
+
+
+def post_changes(queryset, since):
+    """
+    Posts changed after `since`, including posts whose comment count
+    moved: a comment was added or removed under them
+    """
+    window = since - SYNC_OVERLAP
+    comment_type = ContentType.objects.get_for_model(Comment)
+    new_comments = Comment.objects.filter(post=OuterRef('pk'), updated_at__gt=window)
+    removed_comments = Tombstone.objects.filter(
+        content_type=comment_type, post_id=OuterRef('pk'), deleted_at__gt=window)
+    changed = queryset.filter(
+        Q(updated_at__gt=window) | Exists(new_comments) | Exists(removed_comments))
+    deleted = Tombstone.objects.filter(
+        content_type=ContentType.objects.get_for_model(Post), deleted_at__gt=window)
+    return changes_since(changed, deleted)
+
+
+def comment_changes(queryset, post_id, since):
+    window = since - SYNC_OVERLAP
+    changed = queryset.filter(post_id=post_id, updated_at__gt=window)
+    deleted = Tombstone.objects.filter(
+        content_type=ContentType.objects.get_for_model(Comment), post_id=post_id,
+        deleted_at__gt=window)
+    return changes_since(changed, deleted)
+
+
+@receiver(post_delete, sender=Post)
+def bury_post(sender, instance, **kwargs):
+    Tombstone.objects.create(
+        content_type=ContentType.objects.get_for_model(Post),
+        object_id=instance.pk,
+        post_id=instance.pk,
+    )
+
+
+@receiver(post_delete, sender=Comment)
+def bury_comment(sender, instance, origin=None, **kwargs):
+    # The whole post is going away, its tombstone covers the thread
+    if isinstance(origin, Post) or getattr(origin, 'model', None) is Post:
+        return
+    Tombstone.objects.create(
+        content_type=ContentType.objects.get_for_model(Comment),
+        object_id=instance.pk,
+        post_id=instance.post_id,
+    )
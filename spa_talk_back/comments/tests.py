@@ -1,3 +1,1142 @@
-from django.test import TestCase
+import asyncio
+import os
+import runpy
+import shutil
+import tempfile
+import time
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from PIL.JpegImagePlugin import JpegImageFile
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+
+from .cache import api_cache, check_shared_cache
+from .images import (
+    BASE83, MAX_ATTEMPTS, STALE_JOB_TIMEOUT, VARIANT_WIDTHS, claim_jobs, process_image, process_jobs,
+)
+from .renderers import ORJSONRenderer
+from .models import Comment, ImageJob, Post
+from .realtime import comment_event_stream
+from .routers import ReplicaRouter, replica_reads
+from .sessions import session_stats
+from .tree import CommentTree, load_post_comments
+from .uploads import MAX_IMAGE_UPLOAD_SIZE
+from .sync import SYNC_CURSOR_HEADER, SYNC_RETENTION, encode_sync_cursor
+
+
+def image_file(name='photo.png', size=(640, 480), image_format='PNG'):
+    output = BytesIO()
+    Image.new('RGB', size, (200, 80, 40)).save(output, format=image_format)
+    return SimpleUploadedFile(name, output.getvalue(), content_type=Image.MIME[image_format])
+
+
+class MediaRootMixin:
+    """Stores the uploads of the test in a throwaway MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+
+def as_json_types(value):
+    """MessagePack output with its timestamps rendered the way the JSON output has them"""
+    if isinstance(value, datetime):
+        return serializers.DateTimeField().to_representation(value)
+    if isinstance(value, dict):
+        return {key: as_json_types(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [as_json_types(item) for item in value]
+    return value
+
+
+class MessagePackRoundTripTests(APITestCase):
+    def setUp(self):
+        api_cache.clear()
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.other = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.post = Post.objects.create(user=self.user, text='First post')
+        self.root = Comment.objects.create(post=self.post, user=self.other, text='Root comment')
+        self.reply = Comment.objects.create(
+            post=self.post, user=self.user, text='A reply', parent=self.root)
+        self.client.force_authenticate(self.user)
+
+    def get_both(self, url, params=None):
+        json_response = self.client.get(url, params, HTTP_ACCEPT='application/json')
+        msgpack_response = self.client.get(url, params, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(json_response.status_code, 200)
+        self.assertEqual(msgpack_response.status_code, 200)
+        self.assertEqual(msgpack_response['Content-Type'], 'application/msgpack')
+        return json_response.json(), msgpack.unpackb(msgpack_response.content, timestamp=3)
+
+    def assertParity(self, url, params=None):
+        json_data, msgpack_data = self.get_both(url, params)
+        self.assertEqual(as_json_types(msgpack_data), json_data)
+        return msgpack_data
+
+    def test_post_list(self):
+        data = self.assertParity('/api/posts/')
+        self.assertIsInstance(data['results'][0]['created_at'], datetime)
+
+    def test_post_list_with_options(self):
+        self.assertParity('/api/posts/', {'pagination': 'cursor', 'embed_comments': 2})
+        self.assertParity('/api/posts/', {'fields': 'id,user,created_at', 'author': 'compact'})
+        self.assertParity('/api/posts/', {'users': 'normalized'})
+
+    def test_post_detail(self):
+        self.assertParity(f'/api/posts/{self.post.pk}/')
+
+    def test_comment_list_and_detail(self):
+        self.assertParity('/api/comments/')
+        self.assertParity(f'/api/comments/{self.root.pk}/')
+
+    def test_comment_thread(self):
+        data = self.assertParity(f'/api/posts/{self.post.pk}/comments/')
+        root = next(node for node in data if node['id'] == self.root.pk)
+        self.assertEqual(root['replies'][0]['id'], self.reply.pk)
+        self.assertIsInstance(root['replies'][0]['updated_at'], datetime)
+
+    def test_paginated_comment_thread(self):
+        self.assertParity(f'/api/posts/{self.post.pk}/comments/', {'pagination': 'cursor'})
+        self.assertParity(f'/api/comments/{self.root.pk}/replies/')
+
+    def test_create_comment_from_msgpack(self):
+        body = msgpack.packb({'post': self.post.pk, 'text': 'Sent as MessagePack'})
+        response = self.client.post(
+            '/api/comments/', body, content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        data = msgpack.unpackb(response.content, timestamp=3)
+        self.assertEqual(data['text'], 'Sent as MessagePack')
+        self.assertIsInstance(data['created_at'], datetime)
+        self.assertTrue(Comment.objects.filter(pk=data['id'], user=self.user).exists())
+
+    def test_invalid_msgpack_body(self):
+        response = self.client.post(
+            '/api/comments/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
+
+
+class ORJSONParityTests(APITestCase):
+    """ORJSONRenderer output is byte for byte the one of DRF's JSONRenderer"""
+
+    def setUp(self):
+        api_cache.clear()
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.post = Post.objects.create(user=self.user, text='First post')
+        self.root = Comment.objects.create(post=self.post, user=self.user, text='Root comment')
+        Comment.objects.create(post=self.post, user=self.user, text='A reply', parent=self.root)
+        self.client.force_authenticate(self.user)
+
+    def assertParity(self, data, context=None):
+        self.assertEqual(
+            ORJSONRenderer().render(data, 'application/json', context),
+            JSONRenderer().render(data, 'application/json', context))
+
+    def test_endpoints(self):
+        for url, params in [
+            ('/api/posts/', None),
+            ('/api/posts/', {'pagination': 'cursor', 'embed_comments': 2}),
+            ('/api/posts/', {'users': 'normalized'}),
+            (f'/api/posts/{self.post.pk}/', None),
+            ('/api/comments/', None),
+            (f'/api/posts/{self.post.pk}/comments/', None),
+            (f'/api/posts/{self.post.pk}/comments/', {'pagination': 'cursor'}),
+        ]:
+            response = self.client.get(url, params, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertParity(response.data, {'request': response.wsgi_request, 'response': response})
+
+    def test_raw_values(self):
+        data = {
+            'utc': datetime(2026, 10, 18, 8, 51, 3, 123456, tzinfo=dt_timezone.utc),
+            'whole_seconds': timezone.now().replace(microsecond=0),
+            'offset': datetime(2026, 10, 18, 8, 51, tzinfo=dt_timezone(timedelta(hours=3))),
+            'naive': datetime(2026, 10, 18, 8, 51),
+            'date': date(2026, 10, 18),
+            'decimal': Decimal('1.5'),
+            'lazy': gettext_lazy('Comments'),
+            'separators': '\u2028\u2029',
+        }
+        self.assertParity(data)
+
+
+# spa_talk_back.test_settings adds replica1, a test mirror of default ↓
+REPLICA_MIRROR = 'replica1' in settings.DATABASES
+
+
+@skipUnless(REPLICA_MIRROR, "needs --settings=spa_talk_back.test_settings")
+@override_settings(REPLICA_DATABASES=['replica1'])
+class ReplicaRoutingTests(APITransactionTestCase):
+    databases = {'default', 'replica1'} if REPLICA_MIRROR else {'default'}
+
+    def setUp(self):
+        api_cache.clear()
+        caches['default'].clear()
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.other = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.post = Post.objects.create(user=self.user, text='First post')
+        Comment.objects.create(post=self.post, user=self.other, text='Root comment')
+
+    def queries_by_alias(self, method, url, data=None):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica1']) as replica:
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400)
+        return len(primary.captured_queries), len(replica.captured_queries)
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Post))
+        token = replica_reads.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Post), 'replica1')
+            self.assertEqual(router.db_for_write(Post), 'default')
+        finally:
+            replica_reads.reset(token)
+        self.assertFalse(router.allow_migrate('replica1', 'comments'))
+        self.assertTrue(router.allow_migrate('default', 'comments'))
+
+    def test_safe_requests_read_from_replica(self):
+        self.client.force_authenticate(self.other)
+        for url in ['/api/posts/', f'/api/posts/{self.post.pk}/',
+                    f'/api/posts/{self.post.pk}/comments/', '/api/comments/']:
+            primary, replica = self.queries_by_alias('get', url)
+            self.assertEqual(primary, 0, url)
+            self.assertGreater(replica, 0, url)
+
+    def test_writer_reads_from_primary_for_a_while(self):
+        self.client.force_authenticate(self.user)
+        primary, replica = self.queries_by_alias(
+            'post', '/api/comments/', {'post': self.post.pk, 'text': 'New comment'})
+        self.assertEqual(replica, 0)
+
+        primary, replica = self.queries_by_alias('get', f'/api/posts/{self.post.pk}/comments/')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        # Other users are not pinned ↓
+        self.client.force_authenticate(self.other)
+        primary, replica = self.queries_by_alias('get', f'/api/posts/{self.post.pk}/comments/')
+        self.assertEqual(primary, 0)
+
+        # Once the window is over the writer is back on the replicas ↓
+        caches['default'].clear()
+        self.client.force_authenticate(self.user)
+        primary, replica = self.queries_by_alias('get', f'/api/posts/{self.post.pk}/comments/')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_other_views_stay_on_primary(self):
+        primary, replica = self.queries_by_alias('get', '/api/search/?q=post')
+        self.assertEqual(replica, 0)
+
+
+class ConditionalListTests(APITestCase):
+    def setUp(self):
+        api_cache.clear()
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.post = Post.objects.create(user=self.user, text='First post')
+
+    def get_list(self, etag=None, params=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get('/api/posts/', params, **headers)
+
+    def test_not_modified_until_the_page_changes(self):
+        for params in [None, {'pagination': 'cursor'}]:
+            etag = self.get_list(params=params)['ETag']
+            self.assertEqual(self.get_list(etag, params).status_code, 304)
+
+            Comment.objects.create(post=self.post, user=self.user, text='New comment')
+            response = self.get_list(etag, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_author_changes_are_not_hidden_by_a_304(self):
+        etag = self.get_list()['ETag']
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.get_list(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['user']['username'], 'renamed')
+
+    def test_embedded_comment_edits_are_not_hidden_by_a_304(self):
+        comment = Comment.objects.create(post=self.post, user=self.user, text='Before')
+        params = {'embed_comments': 2}
+        etag = self.get_list(params=params)['ETag']
+        self.assertEqual(self.get_list(etag, params).status_code, 304)
+
+        comment.text = 'After'
+        comment.save()
+        response = self.get_list(etag, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['latest_comments'][0]['text'], 'After')
+
+    def test_no_aggregate_over_the_feed(self):
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.get_list(params={'pagination': 'cursor'})
+        self.assertFalse(any('MAX(' in query['sql'] for query in queries.captured_queries))
+
+
+class SyncCursorTests(APITestCase):
+    def setUp(self):
+        api_cache.clear()
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.post = Post.objects.create(user=self.user, text='First post')
+        self.urls = ['/api/posts/', f'/api/posts/{self.post.pk}/comments/']
+        self.client.force_authenticate(self.user)
+
+    def sync(self, cursor):
+        return [self.client.get(url, {'since': cursor}).status_code for url in self.urls]
+
+    def test_cursor_from_the_header(self):
+        for url in self.urls:
+            cursor = self.client.get(url)[SYNC_CURSOR_HEADER]
+            response = self.client.get(url, {'since': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['deleted'], [])
+
+    def test_malformed_cursor(self):
+        for cursor in ['not a cursor', b64encode(b'x=1').decode(), b64encode(b't=yesterday').decode()]:
+            self.assertEqual(self.sync(cursor), [400, 400])
+
+    def test_naive_cursor(self):
+        self.assertEqual(self.sync('dD0yMDI2LTEwLTE4VDA4OjUx'), [400, 400])
+
+    def test_expired_cursor(self):
+        cursor = encode_sync_cursor(timezone.now() - SYNC_RETENTION - SYNC_RETENTION)
+        self.assertEqual(self.sync(cursor), [410, 410])
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_local_memory_api_cache(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['comments.W001'])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/0',
+    }})
+    def test_shared_api_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class ParentFieldsTests(APITestCase):
+    def setUp(self):
+        api_cache.clear()
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.other = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.post = Post.objects.create(user=self.user, text='First post')
+        self.client.force_authenticate(self.user)
+
+    def add_replies(self, count):
+        for number in range(count):
+            root = Comment.objects.create(post=self.post, user=self.other, text=f'Root {number}')
+            Comment.objects.create(post=self.post, user=self.user, text='Reply', parent=root)
+
+    def count_queries(self, url, params):
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries), response.json()
+
+    def test_parent_info_in_comment_list_is_joined(self):
+        params = {'fields': 'id,parent_info'}
+        self.add_replies(1)
+        few, _ = self.count_queries('/api/comments/', params)
+        self.add_replies(5)
+        many, data = self.count_queries('/api/comments/', params)
+        self.assertEqual(few, many)
+
+        infos = [item['parent_info'] for item in data['results'] if item['parent_info']]
+        self.assertEqual(len(infos), 6)
+        self.assertEqual(infos[0]['username'], 'reader')
+        self.assertTrue(infos[0]['text'].startswith('Root'))
+
+    def test_parent_info_in_thread_comes_from_the_thread(self):
+        params = {'fields': 'id,parent_info'}
+        self.add_replies(1)
+        few, _ = self.count_queries(f'/api/posts/{self.post.pk}/comments/', params)
+        self.add_replies(5)
+        many, data = self.count_queries(f'/api/posts/{self.post.pk}/comments/', params)
+        self.assertEqual(few, many)
+
+        infos = [item['parent_info'] for item in data if item['parent_info']]
+        self.assertEqual(len(infos), 6)
+        self.assertEqual(infos[0]['username'], 'reader')
+
+
+class CommentPathTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.post = Post.objects.create(user=self.user, text='First post')
+
+    def comment(self, parent=None, text='Comment'):
+        return Comment.objects.create(post=self.post, user=self.user, text=text, parent=parent)
+
+    def assertPath(self, comment, *ancestors):
+        comment.refresh_from_db()
+        self.assertEqual(
+            comment.path, ''.join(Comment.build_path('', item.pk) for item in [*ancestors, comment]))
+        self.assertEqual(comment.depth, len(ancestors))
+
+    def test_nested_replies(self):
+        root = self.comment()
+        reply = self.comment(root)
+        nested = self.comment(reply)
+        self.assertPath(root)
+        self.assertPath(reply, root)
+        self.assertPath(nested, root, reply)
+        self.assertEqual(nested.ancestor_ids, [root.pk, reply.pk])
+        self.assertEqual(list(Comment.objects.ancestors_of(nested)), [root, reply])
+        self.assertEqual(set(Comment.objects.subtree_of(reply)), {reply, nested})
+
+    def test_moved_subtree(self):
+        root, other = self.comment(), self.comment()
+        reply = self.comment(root)
+        nested = self.comment(reply)
+        deepest = self.comment(nested)
+
+        reply.parent = other
+        reply.save()
+        self.assertPath(reply, other)
+        self.assertPath(nested, other, reply)
+        self.assertPath(deepest, other, reply, nested)
+
+        # Up to the root of its own thread ↓
+        nested.refresh_from_db()
+        nested.parent = None
+        nested.save()
+        self.assertPath(nested)
+        self.assertPath(deepest, nested)
+        self.assertPath(reply, other)
+
+    def test_backfill_migration(self):
+        root = self.comment()
+        reply = self.comment(root)
+        nested = self.comment(reply)
+        other = self.comment()
+        Comment.objects.update(path='', depth=0)
+
+        migration = import_module('comments.migrations.0012_comment_path_depth')
+        migration.backfill_comment_paths(apps, None)
+        self.assertPath(root)
+        self.assertPath(reply, root)
+        self.assertPath(nested, root, reply)
+        self.assertPath(other)
+
+
+class CommentCounterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.post = Post.objects.create(user=self.user, text='First post')
+
+    def comment(self, parent=None):
+        return Comment.objects.create(post=self.post, user=self.user, text='Comment', parent=parent)
+
+    def assertCounts(self, comments_count, **reply_counts):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, comments_count)
+        for name, count in reply_counts.items():
+            self.assertEqual(Comment.objects.get(pk=getattr(self, name).pk).reply_count, count, name)
+
+    def test_create_and_delete(self):
+        self.root = self.comment()
+        self.reply = self.comment(self.root)
+        self.other_reply = self.comment(self.root)
+        self.assertCounts(3, root=2, reply=0)
+
+        self.other_reply.delete()
+        self.assertCounts(2, root=1, reply=0)
+
+    def test_cascade_delete_of_a_subtree(self):
+        self.root = self.comment()
+        self.reply = self.comment(self.root)
+        nested = self.comment(self.reply)
+        self.comment(nested)
+        self.sibling = self.comment(self.root)
+        self.assertCounts(5, root=2, reply=1)
+
+        self.reply.delete()
+        self.assertCounts(2, root=1, sibling=0)
+
+    def test_moved_reply(self):
+        self.root, self.other = self.comment(), self.comment()
+        self.reply = self.comment(self.root)
+        self.reply.parent = self.other
+        self.reply.save()
+        self.assertCounts(3, root=0, other=1)
+
+    def test_post_delete_removes_its_comments(self):
+        self.comment(self.comment())
+        self.post.delete()
+        self.assertFalse(Comment.objects.exists())
+
+    def test_backfill_migration(self):
+        self.root = self.comment()
+        self.reply = self.comment(self.root)
+        self.comment(self.reply)
+        Post.objects.update(comments_count=0)
+        Comment.objects.update(reply_count=7)
+
+        migration = import_module('comments.migrations.0013_comment_counters')
+        migration.backfill_comment_counters(apps, None)
+        self.assertCounts(3, root=1, reply=1)
+        self.assertEqual(Comment.objects.filter(reply_count=0).count(), 1)
+
+
+class DatabasePoolTests(APITestCase):
+    def load_settings(self, **variables):
+        environment = {
+            'DATABASE_URL': 'postgres://user:password@db:5432/talk_back',
+            'CACHE_URL': 'redis://cache:6379/0',
+            'SESSION_CACHE_URL': 'redis://cache:6379/1',
+            **variables,
+        }
+        with mock.patch.dict(os.environ, environment):
+            for name in ['DATABASE_POOL_MAX_SIZE', 'DATABASE_POOL_MIN_SIZE', 'DATABASE_REPLICA_URLS']:
+                os.environ.pop(name, None)
+            return runpy.run_module('spa_talk_back.settings')
+
+    def test_pool_sized_per_worker(self):
+        loaded = self.load_settings(
+            DATABASE_POOL='pool', DATABASE_MAX_CONNECTIONS='40', WEB_CONCURRENCY='4')
+        database = loaded['DATABASES']['default']
+        self.assertEqual(database['OPTIONS']['pool'], {'min_size': 2, 'max_size': 10, 'timeout': 10.0})
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+
+        # Never below two connections, nor a minimum above the maximum ↓
+        loaded = self.load_settings(
+            DATABASE_POOL='pool', DATABASE_MAX_CONNECTIONS='4', WEB_CONCURRENCY='4')
+        self.assertEqual(loaded['DATABASES']['default']['OPTIONS']['pool']['max_size'], 2)
+        self.assertEqual(loaded['DATABASES']['default']['OPTIONS']['pool']['min_size'], 2)
+
+    def test_persistent_and_per_request_connections(self):
+        database = self.load_settings(DATABASE_POOL='persistent')['DATABASES']['default']
+        self.assertNotIn('pool', database.get('OPTIONS', {}))
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        database = self.load_settings(DATABASE_POOL='')['DATABASES']['default']
+        self.assertNotIn('pool', database.get('OPTIONS', {}))
+
+    def test_stats_report_pool_counters_per_alias(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_authenticate(admin)
+        pool = SimpleNamespace(closed=False, get_stats=lambda: {
+            'pool_min': 2, 'pool_max': 10, 'pool_size': 4, 'pool_available': 1,
+            'requests_num': 50, 'requests_queued': 4, 'requests_wait_ms': 30,
+        })
+        with mock.patch.object(connections['default'], 'pool', pool, create=True):
+            response = self.client.get('/api/stats/')
+        self.assertEqual(response.status_code, 200)
+
+        databases = response.json()['databases']
+        self.assertEqual(set(databases), set(connections))
+        self.assertGreater(databases['default']['connects'], 0)
+        self.assertEqual(databases['default']['pool'], {
+            'min_size': 2, 'max_size': 10, 'size': 4, 'in_use': 3, 'saturation': 0.3,
+            'waiting': 0, 'checkouts': 50, 'queued_checkouts': 4, 'wait_ms': 30,
+            'average_wait_ms': 7.5, 'failed_checkouts': 0, 'connections_opened': 0,
+            'connections_lost': 0, 'bad_returns': 0,
+        })
+        for alias in set(connections) - {'default'}:
+            self.assertIsNone(databases[alias]['pool'])
+
+    def test_stats_are_for_admins_only(self):
+        self.assertIn(self.client.get('/api/stats/').status_code, (401, 403))
+        user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/stats/').status_code, 403)
+
+
+class CommentEventStreamTests(APITestCase):
+    def test_no_stream_under_wsgi(self):
+        user = User.objects.create_user('author', 'author@example.com', 'password')
+        post = Post.objects.create(user=user, text='First post')
+        response = self.client.get(f'/api/posts/{post.pk}/comments/events/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.streaming)
+        self.assertEqual(self.client.get('/api/posts/0/comments/events/').status_code, 404)
+
+    def test_comment_saved_when_the_channel_layer_is_down(self):
+        user = User.objects.create_user('author', 'author@example.com', 'password')
+        post = Post.objects.create(user=user, text='First post')
+        self.client.force_authenticate(user)
+        layer = mock.Mock(group_send=mock.AsyncMock(side_effect=ConnectionError))
+        with mock.patch('comments.realtime.get_channel_layer', return_value=layer), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/comments/', {'post': post.pk, 'text': 'Still saved'})
+        self.assertEqual(response.status_code, 201)
+        layer.group_send.assert_called_once()
+        self.assertTrue(Comment.objects.filter(text='Still saved').exists())
+
+
+class CommentSocketTests(APITransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.post = Post.objects.create(user=self.user, text='First post')
+
+    def communicator(self, origin='https://talk-back.onrender.com'):
+        from spa_talk_back.asgi import application
+        return WebsocketCommunicator(
+            application, f'/ws/posts/{self.post.pk}/comments/',
+            headers=[(b'origin', origin.encode()), (b'host', b'spa-talk-back.onrender.com')])
+
+    async def connects(self, origin):
+        communicator = self.communicator(origin)
+        connected, _ = await communicator.connect()
+        await communicator.disconnect()
+        return connected
+
+    async def test_frontend_origins_only(self):
+        self.assertTrue(await self.connects('https://talk-back.onrender.com'))
+        self.assertTrue(await self.connects('http://localhost:5173'))
+        self.assertFalse(await self.connects('https://elsewhere.example.com'))
+
+    async def test_created_and_deleted_deltas(self):
+        communicator = self.communicator()
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        reply = await database_sync_to_async(self.create_reply)()
+        messages = [await communicator.receive_json_from() for _ in range(2)]
+        self.assertEqual([message['event'] for message in messages], ['created', 'created'])
+        self.assertEqual([message['comment']['id'] for message in messages],
+                         [reply.parent_id, reply.pk])
+        self.assertEqual(messages[1]['comment']['text'], 'A reply')
+        self.assertEqual(messages[1]['comment']['level'], 1)
+        self.assertEqual(messages[1]['comment']['parent_info']['text'], 'Root comment')
+
+        deleted = {'id': reply.pk, 'post': self.post.pk, 'parent': reply.parent_id}
+        await database_sync_to_async(reply.delete)()
+        message = await communicator.receive_json_from()
+        self.assertEqual(message, {'event': 'deleted', 'comment': deleted})
+        await communicator.disconnect()
+
+    async def test_unknown_post_is_refused(self):
+        from spa_talk_back.asgi import application
+        communicator = WebsocketCommunicator(
+            application, '/ws/posts/0/comments/',
+            headers=[(b'origin', b'https://talk-back.onrender.com')])
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_event_stream(self):
+        stream = comment_event_stream(self.post.pk)
+        try:
+            # The stream has joined the post's group once it sent its first line ↓
+            self.assertEqual(await anext(stream), 'retry: 3000\n\n')
+            reply = await database_sync_to_async(self.create_reply)()
+            event = await asyncio.wait_for(anext(stream), 5)
+            self.assertTrue(event.startswith('event: created\ndata: '))
+            self.assertIn(f'"id": {reply.parent_id}', event)
+        finally:
+            await stream.aclose()
+
+    def create_reply(self):
+        root = Comment.objects.create(post=self.post, user=self.user, text='Root comment')
+        return Comment.objects.create(post=self.post, user=self.user, text='A reply', parent=root)
+
+
+class CompressionTests(APITestCase):
+    def setUp(self):
+        api_cache.clear()
+        user = User.objects.create_user('author', 'author@example.com', 'password')
+        for number in range(20):
+            Post.objects.create(user=user, text=f'Post number {number} ' * 5)
+
+    def test_api_responses_are_compressed(self):
+        response = self.client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_html_pages_are_not(self):
+        response = self.client.get('/api/posts/', HTTP_ACCEPT='text/html', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ImageJobPipelineTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+
+    def post_with_image(self, **kwargs):
+        return Post.objects.create(user=self.user, text='Post', image=image_file(**kwargs))
+
+    def run_jobs(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return process_jobs(claim_jobs(10), executor)
+
+    def test_claim_marks_jobs_as_processing_once(self):
+        post = self.post_with_image()
+        self.assertEqual(post.image_status, ImageJob.PENDING)
+
+        jobs = claim_jobs(10)
+        self.assertEqual([job.object_id for job in jobs], [post.pk])
+        job = ImageJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (ImageJob.PROCESSING, 1))
+        # Already claimed, another worker polling gets nothing ↓
+        self.assertEqual(claim_jobs(10), [])
+
+    def test_finish_stores_the_resized_image_and_variants(self):
+        post = self.post_with_image()
+        self.assertEqual(self.run_jobs(), 1)
+
+        post.refresh_from_db()
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.assertEqual(post.image_status, ImageJob.DONE)
+        self.assertEqual(post.image.name, job.result)
+        self.assertTrue(post.image.name.endswith('_resized.png'))
+        self.assertEqual((post.image.width, post.image.height), (320, 240))
+        self.assertEqual(post.image_meta['placeholder'], job.meta['placeholder'])
+        self.assertTrue(post.image_meta['variants'])
+        for variant in post.image_meta['variants']:
+            self.assertTrue(post.image.storage.exists(variant['name']))
+
+    def test_equal_upload_reuses_the_processed_result(self):
+        # Both uploaded before either was processed, so both are queued ↓
+        first = self.post_with_image()
+        second = self.post_with_image()
+        self.assertEqual(ImageJob.objects.count(), 2)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            process_jobs(claim_jobs(1), executor)
+        first.refresh_from_db()
+
+        with mock.patch('comments.images.process_image') as process_image:
+            self.assertEqual(self.run_jobs(), 1)
+        process_image.assert_not_called()
+
+        second.refresh_from_db()
+        self.assertEqual(second.image_status, ImageJob.DONE)
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(second.image_meta, first.image_meta)
+
+    def test_unreadable_image_fails_the_job(self):
+        post = self.post_with_image()
+        post.image.storage.delete(post.image.name)
+        self.run_jobs()
+
+        post.refresh_from_db()
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertTrue(job.error)
+        self.assertEqual(post.image_status, ImageJob.FAILED)
+
+    def test_job_abandoned_on_its_last_attempt_is_failed(self):
+        post = self.post_with_image()
+        stale = timezone.now() - STALE_JOB_TIMEOUT - timedelta(minutes=1)
+        ImageJob.objects.update(status=ImageJob.PROCESSING, attempts=MAX_ATTEMPTS, updated_at=stale)
+
+        self.assertEqual(claim_jobs(10), [])
+        post.refresh_from_db()
+        job = ImageJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (ImageJob.FAILED, MAX_ATTEMPTS))
+        self.assertEqual(post.image_status, ImageJob.FAILED)
+
+    def test_job_abandoned_before_its_last_attempt_is_retried(self):
+        self.post_with_image()
+        stale = timezone.now() - STALE_JOB_TIMEOUT - timedelta(minutes=1)
+        ImageJob.objects.update(status=ImageJob.PROCESSING, attempts=1, updated_at=stale)
+
+        self.assertEqual(len(claim_jobs(10)), 1)
+        self.assertEqual(ImageJob.objects.get().attempts, 2)
+
+
+class ImageVariantTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def test_post_exposes_variants_and_placeholder_once_processed(self):
+        response = self.client.post('/api/posts/', {'text': 'Post', 'image': image_file()}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['image_status'], ImageJob.PENDING)
+        self.assertIsNone(response.data['image_variants'])
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            process_jobs(claim_jobs(10), executor)
+        data = self.client.get(f"/api/posts/{response.data['id']}/").data
+        variants = data['image_variants']
+        self.assertEqual(data['image_status'], ImageJob.DONE)
+        # Dimensions of the resized image, variants of the original ↓
+        self.assertEqual((variants['width'], variants['height']), (320, 240))
+        self.assertEqual(sorted({variant['width'] for variant in variants['srcset']}), [160, 320, 640])
+        for variant in variants['srcset']:
+            self.assertTrue(variant['url'].startswith('http://testserver/media/post_images/'))
+            self.assertEqual(variant['height'], variant['width'] * 3 // 4)
+        self.assertIn('image/webp', {variant['type'] for variant in variants['srcset']})
+
+    def test_placeholder_is_a_blurhash_of_the_image(self):
+        placeholder = process_image(image_file().read())['placeholder']
+        # 4x3 components: size flag, max AC, 4 characters of DC, 2 per AC component ↓
+        self.assertEqual(len(placeholder), 2 + 4 + 2 * 11)
+        self.assertEqual(placeholder[0], BASE83[3 + 2 * 9])
+        dc = 0
+        for character in placeholder[2:6]:
+            dc = dc * 83 + BASE83.index(character)
+        self.assertEqual((dc >> 16, (dc >> 8) & 255, dc & 255), (200, 80, 40))
+
+    def test_jpeg_is_decoded_at_the_largest_variant_size(self):
+        data = image_file('photo.jpg', (4000, 3000), 'JPEG').read()
+        draft = JpegImageFile.draft
+        with mock.patch.object(JpegImageFile, 'draft', autospec=True, side_effect=draft) as spy:
+            processed = process_image(data, (320, 240))
+        # Before load(), so libjpeg only ever decodes it at half its size ↓
+        self.assertEqual(spy.call_args_list[0], mock.call(mock.ANY, 'RGB', (1280, 960)))
+        self.assertEqual(max(variant['width'] for variant in processed['variants']), VARIANT_WIDTHS[-1])
+        self.assertEqual((processed['width'], processed['height']), (320, 240))
+
+    def test_png_is_not_drafted(self):
+        with mock.patch.object(JpegImageFile, 'draft') as spy:
+            process_image(image_file().read())
+        spy.assert_not_called()
+
+
+class LimitedUploadTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, **files):
+        return self.client.post('/api/posts/', {'text': 'Post', **files}, format='multipart')
+
+    def assertRejected(self, response, message):
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, str(response.data))
+        self.assertFalse(Post.objects.exists())
+
+    def test_image_and_text_file_within_the_limits(self):
+        text = SimpleUploadedFile('notes.txt', b'Some notes', content_type='text/plain')
+        response = self.upload(image=image_file(), file=text)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['file'].endswith('.txt'))
+
+    def test_oversized_image(self):
+        # A valid signature, so only the size can reject it ↓
+        data = b'\x89PNG\r\n\x1a\n' + bytes(MAX_IMAGE_UPLOAD_SIZE)
+        image = SimpleUploadedFile('huge.png', data, content_type='image/png')
+        self.assertRejected(self.upload(image=image), "cannot exceed 5120KB")
+
+    def test_oversized_text_file(self):
+        text = SimpleUploadedFile('notes.txt', b'a' * 102401, content_type='text/plain')
+        self.assertRejected(self.upload(file=text), "cannot exceed 100KB")
+
+    def test_image_of_the_wrong_type(self):
+        image = SimpleUploadedFile('photo.png', b'<svg xmlns="http://www.w3.org/2000/svg"/>',
+                                   content_type='image/png')
+        self.assertRejected(self.upload(image=image), 'Only JPG, GIF and PNG images are allowed.')
+
+    def test_text_file_of_the_wrong_type(self):
+        text = SimpleUploadedFile('script.sh', b'echo hi', content_type='text/plain')
+        self.assertRejected(self.upload(file=text), 'Only TXT files are allowed.')
+
+    def test_unexpected_file_field(self):
+        self.assertRejected(self.upload(avatar=image_file()), "Unexpected file field 'avatar'.")
+
+
+@override_settings(CAPTCHA_STATELESS=True)
+class CaptchaTokenTests(APITestCase):
+    def setUp(self):
+        User.objects.create_user('author', 'author@example.com', 'password')
+        take = mock.patch('comments.captcha.captcha_pool.take', return_value=('AB12C', b'png'))
+        take.start()
+        self.addCleanup(take.stop)
+
+    def issue(self):
+        data = self.client.get('/api/login/').data
+        self.assertNotIn('login_captcha_text', self.client.session)
+        return data
+
+    def login(self, token, captcha='ab12c'):
+        return self.client.post('/api/login/', {
+            'username': 'author', 'password': 'password', 'captcha': captcha, 'captcha_token': token,
+        })
+
+    def test_valid_token(self):
+        data = self.issue()
+        image = self.client.get(data['captcha_image'])
+        self.assertEqual((image.status_code, image.content), (200, b'png'))
+
+        response = self.login(data['captcha_token'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access_token', response.data)
+        # The image goes with the spent challenge ↓
+        self.assertEqual(self.client.get(data['captcha_image']).status_code, 404)
+
+    def test_replayed_token(self):
+        token = self.issue()['captcha_token']
+        self.assertEqual(self.login(token).status_code, 200)
+        response = self.login(token)
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'Captcha expired'))
+
+    def test_wrong_answer_spends_the_token(self):
+        token = self.issue()['captcha_token']
+        response = self.login(token, captcha='WRONG')
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'Invalid captcha'))
+        self.assertEqual(self.login(token).data['detail'], 'Captcha expired')
+
+    def test_expired_token(self):
+        token = self.issue()['captcha_token']
+        later = time.time() + settings.CAPTCHA_TIMEOUT + 1
+        with mock.patch('django.core.signing.time.time', return_value=later):
+            response = self.login(token)
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'Captcha expired'))
+
+    def test_tampered_token(self):
+        token = self.issue()['captcha_token']
+        tampered = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+        response = self.login(tampered)
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'Captcha expired'))
+        # The genuine token is still unspent ↓
+        self.assertEqual(self.login(token).status_code, 200)
+
+    def test_token_of_another_form(self):
+        token = self.client.get('/api/register/').data['captcha_token']
+        response = self.login(token)
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'Captcha is required'))
+
+
+@override_settings(CAPTCHA_STATELESS=False)
+class SessionWriteTests(APITestCase):
+    """The captcha answer is the only thing kept in the session"""
+
+    def setUp(self):
+        self.cache = caches[settings.SESSION_CACHE_ALIAS]
+        self.cache.clear()
+
+    def count_writes(self, path, captcha_text='AB12C'):
+        """Database and cache writes of the session while serving the request"""
+        take = mock.patch('comments.captcha.captcha_pool.take', return_value=(captcha_text, b'png'))
+        cache_set = mock.patch.object(self.cache, 'set', wraps=self.cache.set)
+        with take, cache_set as cache_writes, CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(self.client.get(path).status_code, 200)
+        db_writes = [
+            query['sql'] for query in queries.captured_queries
+            if 'django_session' in query['sql'] and query['sql'].startswith(('INSERT', 'UPDATE'))
+        ]
+        return len(db_writes), cache_writes.call_count
+
+    def test_unchanged_session_is_not_written(self):
+        self.assertEqual(self.count_writes('/api/login/'), (1, 1))
+
+        # Same answer, saved by issue_captcha and by the middleware ↓
+        skipped = session_stats.skipped_writes
+        self.assertEqual(self.count_writes('/api/login/'), (0, 0))
+        self.assertGreater(session_stats.skipped_writes, skipped)
+
+        # Not touched at all ↓
+        self.assertEqual(self.count_writes('/api/posts/'), (0, 0))
+
+    def test_modified_session_is_written(self):
+        self.count_writes('/api/login/')
+        writes = session_stats.writes
+        self.assertEqual(self.count_writes('/api/login/', captcha_text='ZZ99Z'), (1, 1))
+        self.assertEqual(session_stats.writes, writes + 1)
+        self.assertEqual(self.client.session['login_captcha_text'], 'ZZ99Z')
+
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(user=self.user, text=f'Post {i}') for i in range(7)]
+
+    def walk(self, url):
+        """Ids of every page following the next links, and the responses"""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response)
+            url = response.data['next']
+        return [[post['id'] for post in page.data['results']] for page in pages], pages
+
+    def test_ties_are_ordered_by_id(self):
+        # Every post created in the same instant, only the id tells them apart ↓
+        Post.objects.update(created_at=timezone.now())
+        ids, pages = self.walk('/api/posts/?pagination=cursor&page_size=3')
+
+        expected = sorted((post.pk for post in self.posts), reverse=True)
+        self.assertEqual(ids, [expected[:3], expected[3:6], expected[6:]])
+        self.assertNotIn('count', pages[0].data)
+        self.assertIsNone(pages[0].data['previous'])
+        self.assertIsNone(pages[-1].data['next'])
+
+    def test_previous_link_returns_the_page_before(self):
+        Post.objects.update(created_at=timezone.now())
+        ids, pages = self.walk('/api/posts/?pagination=cursor&page_size=3')
+
+        previous = self.client.get(pages[2].data['previous']).data
+        self.assertEqual([post['id'] for post in previous['results']], ids[1])
+        previous = self.client.get(previous['previous']).data
+        self.assertEqual([post['id'] for post in previous['results']], ids[0])
+        self.assertIsNone(previous['previous'])
+        self.assertEqual(self.client.get(previous['next']).data['results'], pages[1].data['results'])
+
+    def test_ascending_order(self):
+        Post.objects.update(created_at=timezone.now())
+        ids, _ = self.walk('/api/posts/?pagination=cursor&page_size=3&date_order=asc')
+        self.assertEqual(sum(ids, []), [post.pk for post in self.posts])
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-base64!', b64encode(b'p=yesterday&i=1').decode(), b64encode(b'i=1').decode()):
+            response = self.client.get('/api/posts/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+
+class SearchTests(APITestCase):
+    """Runs the LIKE fallback, the tests use SQLite"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('author', 'author@example.com', 'password')
+
+    def post(self, text, *comments):
+        post = Post.objects.create(user=self.user, text=text)
+        for comment in comments:
+            Comment.objects.create(post=post, user=self.user, text=comment)
+        return post
+
+    def search(self, **params):
+        response = self.client.get('/api/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_query_is_required(self):
+        for params in ({}, {'q': '  '}):
+            response = self.client.get('/api/search/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['detail'], 'Search query is required')
+
+    def test_matches_posts_and_their_comments(self):
+        by_text = self.post('All about Django views')
+        by_comment = self.post('Unrelated', 'I like django too', 'Nothing here')
+        self.post('Flask only', 'Still flask')
+
+        data = self.search(q='DJANGO')
+        hits = {hit['id']: hit for hit in data['results']}
+        self.assertEqual(set(hits), {by_text.pk, by_comment.pk})
+        self.assertEqual(hits[by_text.pk]['headline'], 'All about Django views')
+        self.assertEqual(hits[by_text.pk]['matching_comments'], [])
+        self.assertEqual(
+            [comment['snippet'] for comment in hits[by_comment.pk]['matching_comments']],
+            ['I like django too'])
+
+    def test_snippets_are_limited_per_post(self):
+        self.post('Post', *[f'needle {i}' for i in range(5)])
+        snippets = self.search(q='needle')['results'][0]['matching_comments']
+        # Newest first without ranks ↓
+        self.assertEqual([comment['snippet'] for comment in snippets], ['needle 4', 'needle 3', 'needle 2'])
+        self.assertEqual({comment['username'] for comment in snippets}, {'author'})
+
+    def test_pagination(self):
+        # Every hit ranks 0.0 in the fallback, the id breaks the ties ↓
+        posts = [self.post(f'needle {i}') for i in range(5)]
+        self.post('haystack')
+        ids, url = [], '/api/search/?q=needle&page_size=2'
+        while url:
+            data = self.client.get(url).data
+            self.assertLessEqual(len(data['results']), 2)
+            ids += [hit['id'] for hit in data['results']]
+            url = data['next']
+        self.assertEqual(ids, sorted((post.pk for post in posts), reverse=True))
+
+        previous = self.client.get(data['previous']).data
+        self.assertEqual([hit['id'] for hit in previous['results']], ids[2:4])
+
+
+class CommentThreadTests(APITestCase):
+    def setUp(self):
+        api_cache.clear()
+        self.users = [User.objects.create_user(name, f'{name}@example.com', 'password')
+                      for name in ('alice', 'bob', 'carol')]
+        self.post = Post.objects.create(user=self.users[0], text='Post')
+        self.client.force_authenticate(self.users[0])
+
+    def add_thread(self, depth):
+        parent = None
+        for level in range(depth):
+            parent = Comment.objects.create(
+                post=self.post, user=self.users[level % 3], text=f'Level {level}', parent=parent)
+            Comment.objects.create(post=self.post, user=self.users[(level + 1) % 3], text='Sibling',
+                                   parent=parent)
+
+    def get_thread(self):
+        api_cache.clear()
+        # The validators aggregate, then the thread itself ↓
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/posts/{self.post.pk}/comments/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_tree_is_built_from_one_query(self):
+        self.add_thread(6)
+        context = {'request': APIRequestFactory().get('/')}
+        with self.assertNumQueries(1):
+            data = CommentTree(load_post_comments(self.post.pk), context=context).data
+        self.assertEqual(len(data), 12)
+        deepest = max(data, key=lambda comment: comment['level'])
+        self.assertEqual((deepest['level'], deepest['parent_text']), (6, 'Level 5'))
+
+    def test_thread_endpoint_queries_do_not_grow_with_the_thread(self):
+        self.add_thread(3)
+        self.assertEqual(len(self.get_thread()), 6)
+        self.add_thread(8)
+        self.assertEqual(len(self.get_thread()), 22)
+
+    def test_normalized_users(self):
+        self.add_thread(3)
+        response = self.client.get(f'/api/posts/{self.post.pk}/comments/', {'users': 'normalized'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Accept', response['Vary'])
+
+        users = response.data['users']
+        self.assertEqual(set(users), {str(user.pk) for user in self.users})
+        self.assertEqual(users[str(self.users[1].pk)]['username'], 'bob')
+        for comment in response.data['results']:
+            self.assertNotIn('user', comment)
+            self.assertIn(str(comment['user_id']), users)
+            for reply in comment['replies']:
+                self.assertIn(str(reply['user_id']), users)
+
+        # Without the parameter the author stays nested ↓
+        plain = self.client.get(f'/api/posts/{self.post.pk}/comments/').data
+        self.assertEqual(plain[0]['user']['username'], 'alice')
+
+    def test_normalized_post_list(self):
+        Post.objects.create(user=self.users[1], text='Second')
+        Post.objects.create(user=self.users[0], text='Third')
+        data = self.client.get('/api/posts/', {'users': 'normalized'}).data
+        self.assertEqual(set(data['users']), {str(self.users[0].pk), str(self.users[1].pk)})
+        self.assertEqual(sorted(post['user_id'] for post in data['results']),
+                         sorted([self.users[0].pk, self.users[0].pk, self.users[1].pk]))
@@ -0,0 +1,225 @@
+from collections import defaultdict
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .fieldsets import Fieldset
+from .models import Comment
+from .serializers import CommentNodeSerializer, CommentSerializer
+
+# Default and maximum number of reply levels and replies per comment
+# returned by the paginated thread mode ↓
+THREAD_DEPTH = 2
+THREAD_BREADTH = 3
+MAX_THREAD_DEPTH = 10
+MAX_THREAD_BREADTH = 50
+# Default and maximum number of latest top-level comments embedded
+# per post by ?embed_comments= on the post list ↓
+EMBEDDED_COMMENTS = 3
+MAX_EMBEDDED_COMMENTS = 10
+
+
+class ThreadSerializer(CommentSerializer):
+    """
+    CommentSerializer's fields as CommentTree fills them, for trimming thread
+    queries: parents are part of the thread (or loaded by it), so parent_text
+    and parent_info need the comments' own text and author, not a join
+    """
+
+    class Meta(CommentSerializer.Meta):
+        sparse_sources = {
+            **CommentSerializer.Meta.sparse_sources,
+            'parent_text': ['text'],
+            'parent_info': ['text', 'user__username'],
+        }
+
+
+def load_post_comments(post_id, fieldset=None):
+    """
+    Fetches every comment of a post together with its author and profile
+    in a single query, only with the columns the fieldset needs
+    """
+    fieldset = fieldset or Fieldset()
+    return list(fieldset.trim(Comment.objects.filter(post_id=post_id), ThreadSerializer))
+
+
+async def aload_post_comments(post_id, fieldset=None):
+    """load_post_comments for async views"""
+    fieldset = fieldset or Fieldset()
+    queryset = fieldset.trim(Comment.objects.filter(post_id=post_id), ThreadSerializer)
+    return [comment async for comment in queryset]
+
+
+class CommentTree:
+    """
+    Builds the nested comment payload of a post in memory.
+
+    The output has the same shape as CommentSerializer(comments, many=True):
+    a flat list of all comments, each carrying its nested replies, level,
+    parent_text and parent_info. Replies are linked by reference instead of
+    being serialized again for every ancestor and levels come from the
+    stored depth, so nothing here recurses and deep threads cost no extra
+    queries and no Python stack. The thread fields are left out as well
+    when the context's fieldset excludes them.
+    """
+
+    def __init__(self, comments, context=None):
+        self.comments = list(comments)
+        self.context = context or {}
+        self.fieldset = self.context.get('fieldset') or Fieldset()
+        self.by_id = {comment.id: comment for comment in self.comments}
+
+        # parent_id -> replies, in the same order as obj.replies.all() ↓
+        self.children = defaultdict(list)
+        for comment in self.comments:
+            if comment.parent_id is not None:
+                self.children[comment.parent_id].append(comment)
+
+        self.outside_parents = self._load_outside_parents()
+
+    def _load_outside_parents(self):
+        # Parents that are not part of this list (only possible for a
+        # partial list of comments) are fetched in one extra query
+        missing = {
+            comment.parent_id for comment in self.comments
+            if comment.parent_id is not None and comment.parent_id not in self.by_id
+        }
+        if not missing:
+            return {}
+        parents = Comment.objects.filter(id__in=missing).select_related('user')
+        return {parent.id: parent for parent in parents}
+
+    def parent_of(self, comment):
+        if comment.parent_id is None:
+            return None
+        return self.by_id.get(comment.parent_id) or self.outside_parents.get(comment.parent_id)
+
+    def serialize(self):
+        """
+        Serializes every comment once and links the nested replies,
+        returns the flat serialized list and a {comment id: item} map
+        """
+        if hasattr(self, '_serialized'):
+            return self._serialized, self._nodes
+
+        serialized = CommentNodeSerializer(
+            self.comments, many=True, context=self.context).data
+        nodes = {comment.id: item for comment, item in zip(self.comments, serialized)}
+
+        allows = self.fieldset.allows
+        for comment in self.comments:
+            item = nodes[comment.id]
+            if allows('replies'):
+                item['replies'] = [nodes[child.id] for child in self.children.get(comment.id, ())]
+            if allows('level'):
+                item['level'] = comment.depth
+            parent = self.parent_of(comment)
+            if allows('parent_text'):
+                item['parent_text'] = parent.text if parent is not None else None
+            if allows('parent_info'):
+                item['parent_info'] = {
+                    'id': parent.id,
+                    'text': parent.text,
+                    'username': parent.user.username
+                } if parent is not None else None
+
+        self._serialized, self._nodes = serialized, nodes
+        return serialized, nodes
+
+    @property
+    def data(self):
+        return self.serialize()[0]
+
+    def subtrees(self, comments):
+        """Nested payload of the given comments only, e.g. the roots of a page"""
+        nodes = self.serialize()[1]
+        return [nodes[comment.id] for comment in comments]
+
+
+def load_reply_levels(comments, depth, breadth, fieldset=None):
+    """
+    Loads the first `breadth` replies (newest first, like obj.replies.all())
+    of each comment, and of those replies, down to `depth` levels.
+    Each level is one query using ROW_NUMBER() OVER (PARTITION BY parent_id),
+    so the amount of data is bounded no matter how big the thread is.
+    """
+    fieldset = fieldset or Fieldset()
+    loaded = []
+    frontier = [comment.id for comment in comments if comment.reply_count]
+    for _ in range(depth):
+        if not frontier:
+            break
+        position = Window(
+            RowNumber(),
+            partition_by=F('parent_id'),
+            order_by=[F('created_at').desc(), F('id').desc()],
+        )
+        level = list(
+            fieldset.trim(Comment.objects.filter(parent_id__in=frontier), ThreadSerializer)
+            .annotate(position=position)
+            .filter(position__lte=breadth)
+            .order_by('-created_at', '-id')
+        )
+        loaded += level
+        frontier = [comment.id for comment in level if comment.reply_count]
+    return loaded
+
+
+def expand_thread(comments, context, depth, breadth, more_replies_link):
+    """
+    Nested payload of `comments` with a bounded part of their replies.
+    Every node whose replies were not all loaded gets a `more_replies` link,
+    built by more_replies_link(comment, last_loaded_reply)
+    """
+    comments = list(comments)
+    replies = load_reply_levels(comments, depth, breadth, context.get('fieldset'))
+    tree = CommentTree(comments + replies, context)
+    nodes = tree.serialize()[1]
+    for comment in tree.comments:
+        loaded = tree.children.get(comment.id, [])
+        if comment.reply_count > len(loaded):
+            last = loaded[-1] if loaded else None
+            nodes[comment.id]['more_replies'] = more_replies_link(comment, last)
+        else:
+            nodes[comment.id]['more_replies'] = None
+    return tree.subtrees(comments)
+
+
+def load_comment_previews(post_ids, limit, fieldset=None):
+    """
+    The latest `limit` top-level comments of each post with their authors
+    and profiles, for a whole page of posts in one query using
+    ROW_NUMBER() OVER (PARTITION BY post_id). Returns {post_id: [comment]}
+    """
+    previews = defaultdict(list)
+    if not post_ids or not limit:
+        return previews
+    fieldset = fieldset or Fieldset()
+    position = Window(
+        RowNumber(),
+        partition_by=F('post_id'),
+        order_by=[F('created_at').desc(), F('id').desc()],
+    )
+    comments = (
+        fieldset.trim(
+            Comment.objects.filter(post_id__in=post_ids, parent__isnull=True),
+            CommentNodeSerializer)
+        .annotate(position=position)
+        .filter(position__lte=limit)
+        .order_by('post_id', 'position')
+    )
+    for comment in comments:
+        previews[comment.post_id].append(comment)
+    return previews
+
+
+def serialize_comment_previews(post_ids, limit, context):
+    """{post_id: [node, ...]} of load_comment_previews, serialized in one pass"""
+    previews = load_comment_previews(post_ids, limit, context.get('fieldset'))
+    comments = [comment for post_id in previews for comment in previews[post_id]]
+    nodes = CommentNodeSerializer(comments, many=True, context=context).data
+    serialized = defaultdict(list)
+    for comment, node in zip(comments, nodes):
+        node['level'] = comment.depth
+        serialized[comment.post_id].append(node)
+    return serialized
@@ -0,0 +1,88 @@
+import os
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, load_handler
+from django.http.multipartparser import MultiPartParserError
+
+from .models import MAX_TEXT_FILE_SIZE
+
+# Largest image accepted by the upload endpoints, the pixel limit is
+# checked afterwards from the header (see validate_image_size)
+MAX_IMAGE_UPLOAD_SIZE = 5 * 1024 * 1024
+
+# First bytes of the image formats in IMAGE_FORMATS
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')
+
+UploadLimit = namedtuple('UploadLimit', ['max_size', 'kind'])
+
+IMAGE_UPLOAD = UploadLimit(MAX_IMAGE_UPLOAD_SIZE, 'image')
+TEXT_UPLOAD = UploadLimit(MAX_TEXT_FILE_SIZE, 'text')
+
+
+class UploadRejected(MultiPartParserError):
+    """Raised while the body is still streaming, DRF answers it with a 400"""
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """
+    First handler of the chain: checks every file part against the view's
+    `upload_limits` as its chunks arrive and aborts the request as soon as
+    one is exceeded, before the memory or temporary file handlers after it
+    have buffered the whole upload. Images are recognised by their
+    signature in the first chunk, text files by their extension.
+    """
+
+    def __init__(self, limits, request=None):
+        super().__init__(request)
+        self.limits = limits
+        self.limit = None
+        self.received = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # A body larger than all files and form fields together can't pass,
+        # reject it without reading a byte ↓
+        allowed = sum(limit.max_size for limit in self.limits.values())
+        allowed += settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0
+        if content_length > allowed:
+            raise UploadRejected('Request body is too large.')
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset,
+                         content_type_extra)
+        self.limit = self.limits.get(field_name)
+        self.received = 0
+        if self.limit is None:
+            raise UploadRejected(f"Unexpected file field '{field_name}'.")
+        if self.limit.kind == 'text' and os.path.splitext(file_name)[1].lower() != '.txt':
+            raise UploadRejected('Only TXT files are allowed.')
+        if content_length and content_length > self.limit.max_size:
+            raise UploadRejected(self.size_message())
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and self.limit.kind == 'image' and not raw_data.startswith(IMAGE_SIGNATURES):
+            raise UploadRejected('Only JPG, GIF and PNG images are allowed.')
+        self.received = start + len(raw_data)
+        if self.received > self.limit.max_size:
+            raise UploadRejected(self.size_message())
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def size_message(self):
+        return f"File '{self.file_name}' cannot exceed {self.limit.max_size // 1024}KB."
+
+
+# Views that accept files put LimitedUploadHandler in front of the
+# configured FILE_UPLOAD_HANDLERS for their requests ↓
+class LimitedUploadMixin:
+    upload_limits = {}
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [
+            LimitedUploadHandler(self.upload_limits, request),
+            *(load_handler(handler, request) for handler in settings.FILE_UPLOAD_HANDLERS),
+        ]
+        return super().initialize_request(request, *args, **kwargs)
@@ -1,6 +1,7 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path
-from .views import PostViewSet, CommentViewSet, RegisterUserView, PostCommentsView, LoginView
+from .views import (PostViewSet, CommentViewSet, RegisterUserView, PostCommentsView, LoginView, SearchView,
+                    CaptchaImageView, StatsView, PostCommentEventsView)
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -12,8 +13,13 @@ router.register('comments', CommentViewSet, basename='comment')
 urlpatterns = [
     path('register/', RegisterUserView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
+    path('captcha/<str:key>.png', CaptchaImageView.as_view(), name='captcha-image'),
     path('posts/<int:post_id>/comments/',
          PostCommentsView.as_view(), name='post-comments'),
+    path('posts/<int:post_id>/comments/events/',
+         PostCommentEventsView.as_view(), name='post-comment-events'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('stats/', StatsView.as_view(), name='stats'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 urlpatterns += router.urls
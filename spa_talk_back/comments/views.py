@@ -1,14 +1,50 @@
 from rest_framework import viewsets, status, serializers, filters
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, AllowAny
+from rest_framework.permissions import (
+    SAFE_METHODS, IsAuthenticatedOrReadOnly, AllowAny, IsAdminUser,
+)
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.views import APIView
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
 from rest_framework_simplejwt.tokens import RefreshToken
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate
-from django.db.models import Q
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Max, Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views import View
+from .asyncviews import AsyncViewMixin
+from .cache import MISSING, api_cache, authors_generation, post_list_cache_key
+from .captcha import captcha_image, captcha_pool, check_captcha, issue_captcha
+from .conditional import (
+    aqueryset_validators, instance_validators, not_modified, page_validators, set_validators,
+)
+from .fieldsets import FieldsetMixin, attach_users
 from .models import Post, Comment
-from .serializers import PostSerializer, CommentSerializer, UserSerializer
-from .utils import generate_captcha_text, generate_captcha_image
+from .pagination import CommentCursorPagination, PostCursorPagination, SearchCursorPagination
+from .pooling import database_stats
+from .realtime import comment_event_stream
+from .routers import ReplicaReadMixin
+from .search import matching_comment_snippets, search_posts
+from .serializers import (
+    CommentNodeSerializer, CommentSerializer, PostSearchSerializer, PostSerializer,
+    PostWithCommentsSerializer, UserSerializer,
+)
+from .sessions import session_stats
+from .sync import (
+    comment_changes, decode_sync_cursor, encode_sync_cursor, post_changes, set_sync_cursor,
+)
+from .tree import (
+    EMBEDDED_COMMENTS, MAX_EMBEDDED_COMMENTS, MAX_THREAD_BREADTH, MAX_THREAD_DEPTH,
+    THREAD_BREADTH, THREAD_DEPTH, CommentTree, ThreadSerializer, aload_post_comments,
+    expand_thread, serialize_comment_previews,
+)
+from .uploads import IMAGE_UPLOAD, TEXT_UPLOAD, LimitedUploadMixin
 
 
 class LoginView(APIView):
@@ -16,40 +52,17 @@ class LoginView(APIView):
 
     def get(self, request):
         """Генерация капчи для входа"""
-        captcha_text = generate_captcha_text()
-        captcha_image = generate_captcha_image(captcha_text)
-        # Save in session
-        request.session['login_captcha_text'] = captcha_text
-        request.session.save()  # Force saving the session
-        return Response({
-            'captcha_image': captcha_image
-        })
+        return Response(issue_captcha(request, 'login'))
 
     def post(self, request):
-        # Check captcha
-        user_captcha = request.data.get('captcha', '').strip().upper()
-        stored_captcha = request.session.get(
-            'login_captcha_text', '').strip().upper()
-
-        if not user_captcha or not stored_captcha:
-            return Response(
-                {"detail": "Captcha is required"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        if user_captcha != stored_captcha:
+        # Check captcha, a signed token or the answer kept in the session
+        error = check_captcha(request, 'login')
+        if error:
             return Response(
-                {"detail": "Invalid captcha"},
+                {"detail": error},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            # Clear captcha from session
-            del request.session['login_captcha_text']
-            request.session.save()
-        except KeyError:
-            pass
-
         # Authenticate user
         username = request.data.get('username')
         password = request.data.get('password')
@@ -64,45 +77,41 @@ class LoginView(APIView):
         return Response({'detail': 'Invalid credentials'}, status=status.HTTP_403_FORBIDDEN)
 
 
-class RegisterUserView(APIView):
+# Captcha images as plain PNG. The URL is unique per challenge, so the
+# browser may keep it until the challenge expires ↓
+class CaptchaImageView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request, key):
+        image = captcha_image(key)
+        if image is None:
+            raise NotFound('Captcha expired')
+        response = HttpResponse(image, content_type='image/png')
+        response.headers['Cache-Control'] = f'private, max-age={settings.CAPTCHA_TIMEOUT}, immutable'
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        return response
+
+
+class RegisterUserView(LimitedUploadMixin, APIView):
     parser_classes = [MultiPartParser, FormParser]
     permission_classes = [AllowAny]
+    upload_limits = {'profile.photo': IMAGE_UPLOAD}
 
     def get(self, request):
         """Генерация капчи для регистрации"""
-        captcha_text = generate_captcha_text()
-        captcha_image = generate_captcha_image(captcha_text)
-
-        # Save in session
-        request.session['register_captcha_text'] = captcha_text
-        request.session.save()  # Force saving the session
-
-        return Response({
-            'captcha_image': captcha_image
-        })
+        return Response(issue_captcha(request, 'register'))
 
     def post(self, request):
         try:
-            # Check captcha
-            user_captcha = request.data.get('captcha', '').strip().upper()
-            stored_captcha = request.session.get(
-                'register_captcha_text', '').strip().upper()
-
-            if not user_captcha or not stored_captcha:
-                return Response(
-                    {"detail": "Captcha is required"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            if user_captcha != stored_captcha:
+            # Check captcha, a signed token or the answer kept in the session
+            error = check_captcha(request, 'register')
+            if error:
                 return Response(
-                    {"detail": "Invalid captcha"},
+                    {"detail": error},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Clear captcha from session
-            del request.session['register_captcha_text']
-
             user_data = {
                 'username': request.data.get('username'),
                 'email': request.data.get('email'),
@@ -135,33 +144,150 @@ class RegisterUserView(APIView):
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class PostViewSet(viewsets.ModelViewSet):
+# ?match= modes of the username/email filters. "contains" is served by the
+# trigram indexes, "prefix" and "exact" by the btree ones (see migration 0015) ↓
+USER_FILTER_LOOKUPS = {
+    'contains': 'icontains',
+    'prefix': 'istartswith',
+    'exact': 'iexact',
+}
+
+
+# The list is an async handler (see comments.asyncviews), the other
+# actions still run in a worker thread ↓
+class PostViewSet(ReplicaReadMixin, FieldsetMixin, LimitedUploadMixin, viewsets.ModelViewSet):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    upload_limits = {'image': IMAGE_UPLOAD, 'file': TEXT_UPLOAD}
+    normalizes_users = True
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    # ?pagination=cursor (or an existing ?cursor=) switches the feed to keyset
+    # pagination; otherwise the page-number mode used by Posts.vue stays ↓
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = PostCursorPagination()
+            else:
+                return super().paginator
+        return self._paginator
+
     def list(self, request, *args, **kwargs):
+        # The moment the next ?since= sync starts from, taken before reading ↓
+        now = timezone.now()
         queryset = self.filter_queryset(self.get_queryset())
+        if 'since' in request.query_params:
+            return self.sync(request, queryset, now)
+
+        # Answer If-None-Match / If-Modified-Since before any serialization,
+        # from the rows of the page alone ↓
+        posts = self.get_page(queryset)
+        etag, last_modified = self.get_list_validators(posts)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        if request.user.is_authenticated:
+            data = self.get_list_data(posts)
+        else:
+            data = self.get_cached_list_data(posts)
+        return set_sync_cursor(set_validators(Response(data), etag, last_modified), now)
+
+    def sync(self, request, queryset, now):
+        """?since=<cursor>: only the posts changed or deleted after the cursor"""
+        since = decode_sync_cursor(request.query_params['since'])
+        changed, deleted = post_changes(queryset, since)
+        serializer = self.get_serializer(changed, many=True)
+        response = Response(attach_users({
+            'cursor': encode_sync_cursor(now),
+            'changed': serializer.data,
+            'deleted': deleted,
+        }, serializer.context))
+        return set_sync_cursor(response, now)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = instance_validators(
+            instance, request, 'comments_count', extra=[authors_generation()])
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        serializer = self.get_serializer(instance)
+        data = attach_users(serializer.data, serializer.context)
+        return set_validators(Response(data), etag, last_modified)
+
+    def get_page(self, queryset):
         page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return page if page is not None else list(queryset)
+
+    def get_list_validators(self, posts):
+        # comments_count is part of the tag since new comments don't touch posts,
+        # the page envelope (count, links) since it changes with rows off the page,
+        # and the authors generation since authors have no updated_at ↓
+        extra = [authors_generation()]
+        if self.paginator is not None:
+            extra.append(self.paginator.get_paginated_response([]).data)
+        if self.embeds_comments():
+            # Edits of the embedded previews don't touch their posts ↓
+            extra.append(Comment.objects.filter(
+                post_id__in=[post.pk for post in posts], parent__isnull=True,
+            ).aggregate(last_modified=Max('updated_at'), count=Count('pk')))
+        return page_validators(posts, self.request, 'comments_count', extra=extra)
+
+    def get_cached_list_data(self, posts):
+        # Pages seen by anonymous visitors are the same for everyone,
+        # keep them in the API cache until a post, comment or author changes ↓
+        key = post_list_cache_key(self.request)
+        data = api_cache.get(key)
+        if data is MISSING:
+            data = self.get_list_data(posts)
+            api_cache.set(key, data)
+        return data
+
+    def get_list_data(self, posts):
+        context = self.get_serializer_context()
+        if self.embeds_comments():
+            # The latest comments of every post on the page, in one query ↓
+            limit = get_limit_param(
+                self.request, 'embed_comments', EMBEDDED_COMMENTS, MAX_EMBEDDED_COMMENTS)
+            context['comment_previews'] = serialize_comment_previews(
+                [post.pk for post in posts], limit,
+                {**context, 'fieldset': context['fieldset'].nested()})
+        serializer = self.get_serializer(posts, many=True, context=context)
+        if self.paginator is not None:
+            return attach_users(self.get_paginated_response(serializer.data).data, context)
+        return attach_users(serializer.data, context)
+
+    def embeds_comments(self):
+        params = self.request.query_params
+        return self.action == 'list' and 'embed_comments' in params and 'since' not in params
+
+    def get_serializer_class(self):
+        if self.embeds_comments():
+            return PostWithCommentsSerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
         queryset = Post.objects.all()
+        if self.request.method in SAFE_METHODS:
+            queryset = self.fieldset.trim(queryset, self.get_serializer_class())
+        else:
+            queryset = queryset.select_related('user__profile')
         username = self.request.query_params.get('username', None)
         email = self.request.query_params.get('email', None)
         date_order = self.request.query_params.get('date_order', None)
+        match = self.request.query_params.get('match', 'contains')
+        lookup = USER_FILTER_LOOKUPS.get(match, 'icontains')
 
         if username:
-            queryset = queryset.filter(user__username__icontains=username)
+            queryset = queryset.filter(**{f'user__username__{lookup}': username})
         if email:
-            queryset = queryset.filter(user__email__icontains=email)
+            queryset = queryset.filter(**{f'user__email__{lookup}': email})
         if date_order:
             order = '-created_at' if date_order == 'desc' else 'created_at'
             queryset = queryset.order_by(order)
@@ -169,10 +295,16 @@ class PostViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(ReplicaReadMixin, FieldsetMixin, LimitedUploadMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    upload_limits = {'image': IMAGE_UPLOAD, 'file': TEXT_UPLOAD}
+
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return self.fieldset.trim(Comment.objects.all(), CommentSerializer)
+        return Comment.objects.all()
 
     def perform_create(self, serializer):
         parent_id = self.request.data.get('parent')
@@ -183,12 +315,157 @@ class CommentViewSet(viewsets.ModelViewSet):
             except Comment.DoesNotExist:
                 raise serializers.ValidationError(
                     {"parent": "Parent comment does not exist."})
+        # Comment.save derives depth and the thread path from the parent
         serializer.save(user=self.request.user, parent=parent_comment)
 
+    @action(detail=True, methods=['get'])
+    def replies(self, request, pk=None):
+        """Next page of replies of a comment, see paginated_thread"""
+        comment = self.get_object()
+        return paginated_thread(request, comment.replies.all(), view=self)
+
+
+def get_limit_param(request, name, default, maximum):
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+    return max(0, min(value, maximum))
+
+
+# Returns one page of comments (thread roots or replies of a comment), each
+# with its first ?replies=N replies down to ?depth=N levels. Nodes with more
+# replies than loaded link to /api/comments/<id>/replies/ to continue ↓
+def paginated_thread(request, comments, view):
+    depth = get_limit_param(request, 'depth', THREAD_DEPTH, MAX_THREAD_DEPTH)
+    breadth = get_limit_param(request, 'replies', THREAD_BREADTH, MAX_THREAD_BREADTH)
+    paginator = CommentCursorPagination()
+    context = {'request': request, **view.get_fieldset_context()}
+
+    def more_replies_link(comment, last_loaded):
+        url = request.build_absolute_uri(reverse('comment-replies', args=[comment.id]))
+        url = replace_query_param(url, 'depth', depth)
+        url = replace_query_param(url, 'replies', breadth)
+        if last_loaded is None:
+            return url
+        return paginator.encode_cursor(last_loaded, reverse=False, base_url=url)
+
+    page = paginator.paginate_queryset(
+        view.fieldset.trim(comments, ThreadSerializer), request, view=view)
+    data = expand_thread(page, context, depth, breadth, more_replies_link)
+    response = paginator.get_paginated_response(data)
+    response.data = attach_users(response.data, context)
+    return response
+
+
+class PostCommentsView(AsyncViewMixin, ReplicaReadMixin, FieldsetMixin, APIView):
+    normalizes_users = True
+
+    async def get(self, request, post_id):
+        # ?pagination=cursor returns only a page of top-level comments
+        # with a bounded part of their replies ↓
+        params = request.query_params
+        if params.get('pagination') == 'cursor' or 'cursor' in params:
+            roots = Comment.objects.filter(post_id=post_id, parent__isnull=True)
+            return await sync_to_async(paginated_thread)(request, roots, view=self)
+
+        now = timezone.now()
+        if 'since' in params:
+            return await sync_to_async(self.sync)(request, post_id, now)
+
+        # The whole thread is only serialized when the client's copy is stale ↓
+        etag, last_modified = await aqueryset_validators(
+            Comment.objects.filter(post_id=post_id), request,
+            extra=[await sync_to_async(authors_generation)()])
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        comments = await aload_post_comments(post_id, self.fieldset)
+        # Serializing reads the author cache, keep it off the event loop ↓
+        data = await sync_to_async(self.serialize_thread)(comments)
+        return set_sync_cursor(set_validators(Response(data), etag, last_modified), now)
+
+    def serialize_thread(self, comments):
+        context = {'request': self.request, **self.get_fieldset_context()}
+        return attach_users(CommentTree(comments, context=context).data, context)
+
+    def sync(self, request, post_id, now):
+        """
+        ?since=<cursor>: flat list of the comments created or changed after
+        the cursor (with their level and parent), and the deleted ids
+        """
+        since = decode_sync_cursor(request.query_params['since'])
+        queryset = self.fieldset.trim(Comment.objects.all(), CommentNodeSerializer)
+        changed, deleted = comment_changes(queryset, post_id, since)
+        context = {'request': request, **self.get_fieldset_context()}
+        data = CommentNodeSerializer(changed, many=True, context=context).data
+        if self.fieldset.allows('level'):
+            for node, comment in zip(data, changed):
+                node['level'] = comment.depth
+        response = Response(attach_users({
+            'cursor': encode_sync_cursor(now),
+            'changed': data,
+            'deleted': deleted,
+        }, context))
+        return set_sync_cursor(response, now)
+
+
+# Server-Sent Events fallback of the comments WebSocket (comments.consumers).
+# A plain async Django view: the stream only works under an ASGI server ↓
+class PostCommentEventsView(View):
+    async def get(self, request, post_id):
+        if not await Post.objects.filter(pk=post_id).aexists():
+            raise Http404('Post not found')
+        # A WSGI server would collect the endless stream before sending anything
+        # and keep the worker busy for good; 204 tells EventSource to stop ↓
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+        response = StreamingHttpResponse(
+            comment_event_stream(post_id), content_type='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class SearchView(APIView):
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get(self, request):
+        """Full-text search over posts and their comments, best hits first"""
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response(
+                {"detail": "Search query is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        paginator = SearchCursorPagination()
+        posts = search_posts(text).select_related('user__profile')
+        page = paginator.paginate_queryset(posts, request, view=self)
+        snippets = matching_comment_snippets([post.pk for post in page], text)
+        serializer = PostSearchSerializer(
+            page, many=True, context={'request': request, 'snippets': snippets})
+        return paginator.get_paginated_response(serializer.data)
 
-class PostCommentsView(APIView):
-    def get(self, request, post_id):
-        comments = Comment.objects.filter(post_id=post_id)
-        serializer = CommentSerializer(
-            comments, many=True, context={'request': request})
-        return Response(serializer.data)
+
+# Counters of the caches in this process, to watch the load they take
+# off the database. Each worker process has its own numbers ↓
+class StatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'api_cache': {
+                'hits': api_cache.hits,
+                'shared_hits': api_cache.shared_hits,
+                'misses': api_cache.misses,
+            },
+            'sessions': session_stats.as_dict(),
+            'databases': database_stats(),
+            'captcha_pool': {
+                'available': len(captcha_pool.challenges),
+                'hits': captcha_pool.hits,
+                'misses': captcha_pool.misses,
+            },
+        })
@@ -17,6 +17,7 @@ import dj_database_url
 import environ
 
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 
 env = environ.Env()
 environ.Env.read_env()
@@ -57,11 +58,13 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'corsheaders', 
     'storages',
+    'channels',
 ]
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  
     'django.middleware.security.SecurityMiddleware',
+    'comments.middleware.CompressionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', 
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -99,6 +102,18 @@ STATICFILES_DIRS = [
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 WSGI_APPLICATION = 'spa_talk_back.wsgi.application'
+ASGI_APPLICATION = 'spa_talk_back.asgi.application'
+
+# Fan-out of the comment events (comments.realtime). The in-memory layer
+# only reaches clients of the same process, production uses Redis ↓
+CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+}
+if env.str('CHANNEL_LAYER_URL', default=''):
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {'hosts': [env.str('CHANNEL_LAYER_URL')]},
+    }
 
 
 # Database
@@ -119,6 +134,43 @@ else:
         }
     }
 
+# Read replicas (comments.routers): each URL of DATABASE_REPLICA_URLS becomes a
+# replica<N> alias that safe requests of the feed and threads read from, and
+# whoever wrote keeps reading from default for REPLICA_PIN_SECONDS ↓
+REPLICA_DATABASES = []
+for number, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[]), start=1):
+    DATABASES[f'replica{number}'] = {**dj_database_url.parse(url), 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(f'replica{number}')
+DATABASE_ROUTERS = ['comments.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=10)
+
+# Postgres connections (see comments.pooling for their numbers on /api/stats/):
+# DATABASE_POOL=pool keeps a psycopg pool in each worker process, the mode
+# for the ASGI server; DATABASE_POOL=persistent reuses each thread's connection
+# for DATABASE_CONN_MAX_AGE seconds; otherwise every request connects anew.
+# Pools are sized so that the WEB_CONCURRENCY gunicorn workers together stay
+# within DATABASE_MAX_CONNECTIONS of each server ↓
+DATABASE_POOL = env.str('DATABASE_POOL', default='')
+DATABASE_MAX_CONNECTIONS = env.int('DATABASE_MAX_CONNECTIONS', default=20)
+WEB_CONCURRENCY = env.int('WEB_CONCURRENCY', default=1)
+DATABASE_POOL_MAX_SIZE = env.int(
+    'DATABASE_POOL_MAX_SIZE', default=max(2, DATABASE_MAX_CONNECTIONS // WEB_CONCURRENCY))
+DATABASE_POOL_MIN_SIZE = min(env.int('DATABASE_POOL_MIN_SIZE', default=2), DATABASE_POOL_MAX_SIZE)
+DATABASE_POOL_TIMEOUT = env.float('DATABASE_POOL_TIMEOUT', default=10.0)
+for database in DATABASES.values():
+    if database['ENGINE'] != 'django.db.backends.postgresql':
+        continue
+    database['CONN_HEALTH_CHECKS'] = True
+    if DATABASE_POOL == 'pool':
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS'] = {**database.get('OPTIONS', {}), 'pool': {
+            'min_size': DATABASE_POOL_MIN_SIZE,
+            'max_size': DATABASE_POOL_MAX_SIZE,
+            'timeout': DATABASE_POOL_TIMEOUT,
+        }}
+    elif DATABASE_POOL == 'persistent':
+        database['CONN_MAX_AGE'] = env.int('DATABASE_CONN_MAX_AGE', default=60)
+
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.postgresql',
@@ -191,7 +243,7 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_ALL_ORIGINS = True
-CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken']
+CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken', 'X-Sync-Cursor']
 
 CSRF_TRUSTED_ORIGINS = [
     'http://localhost:5173',
@@ -213,12 +265,64 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'comments.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'comments.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'comments.parsers.MessagePackParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 25,  # For pagination, the number of posts per page
 }
 
 
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Shared cache backend, local memory unless CACHE_URL points elsewhere
+# (e.g. redis://... in production) ↓
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default='locmemcache://'),
+    'sessions': env.cache_url('SESSION_CACHE_URL', default='locmemcache://sessions'),
+}
+# Captcha images and spent captcha tokens, cached API responses with their
+# invalidation generations and replica pins live in the default cache, and
+# sessions in theirs: a local-memory cache is private to one process, so
+# several workers need CACHE_URL and SESSION_CACHE_URL ↓
+if WEB_CONCURRENCY > 1:
+    for alias, variable in [('default', 'CACHE_URL'), ('sessions', 'SESSION_CACHE_URL')]:
+        if CACHES[alias]['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache':
+            raise ImproperlyConfigured(
+                f"{variable} must point at a shared cache (e.g. redis://) "
+                f"when WEB_CONCURRENCY is {WEB_CONCURRENCY}")
+
+# Two-tier API cache (comments.cache): per-process LRU size and lifetime
+# of its entries in seconds, and the timeout in the shared backend ↓
+API_CACHE_ALIAS = 'default'
+API_CACHE_LOCAL_SIZE = 1024
+API_CACHE_LOCAL_TTL = 5
+API_CACHE_TIMEOUT = 300
+
+# Compression of API responses (comments.middleware): smallest body worth
+# compressing in bytes, and levels tuned for latency rather than size ↓
+API_COMPRESSION_MIN_SIZE = 1024
+API_GZIP_LEVEL = 5
+API_BROTLI_QUALITY = 4
+
+# Pre-rendered captchas kept per process (0 renders them on demand), how
+# long a captcha stays valid in seconds, and whether its answer travels in
+# a signed token instead of the session (comments.captcha) ↓
+CAPTCHA_POOL_SIZE = 64
+CAPTCHA_TIMEOUT = 300
+CAPTCHA_STATELESS = env.bool('CAPTCHA_STATELESS', default=True)
+
+
+# Sessions are read from their own cache and written through to the
+# database only when they change (comments.sessions) ↓
+SESSION_ENGINE = 'comments.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
 SESSION_COOKIE_NAME = 'sessionid'
 SESSION_COOKIE_AGE = 1200  # 20 minutes
 SESSION_COOKIE_HTTPONLY = True
@@ -253,6 +357,8 @@ FILE_UPLOAD_PERMISSIONS = 0o644
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o755
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
-FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
+# Larger uploads are streamed to a temporary file instead of memory,
+# the upload endpoints also check their limits while streaming (comments.uploads)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 262144  # 256KB
 
 SITE_ID = 1
@@ -0,0 +1,11 @@
+"""
+Settings for the test suite:
+python manage.py test --settings=spa_talk_back.test_settings
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, REPLICA_DATABASES
+
+# The routing tests read from a mirror of default, so they need no second
+# server; they enable it with override_settings(REPLICA_DATABASES=[...]) ↓
+if not REPLICA_DATABASES:
+    DATABASES['replica1'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}